@@ -0,0 +1,82 @@
+import hmac
+import time
+import hashlib
+import secrets
+import checkpoint
+
+__all__ = ["hash_password", "verify_password", "is_legacy", "verify_legacy", "key", "Sessions"]
+
+ALGORITHM = "pbkdf2_sha256"
+ITERATIONS = 200_000
+
+def hash_password(password: str, salt: bytes=None, iterations: int=ITERATIONS) -> str:
+    # Stored as algorithm$iterations$salt$hash so the cost can be raised later
+    salt = secrets.token_bytes(16) if salt is None else salt
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"{ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+def verify_password(password: str, stored: str) -> bool:
+    if stored is None or not stored.startswith(f"{ALGORITHM}$"):
+        return False
+    _, iterations, salt, _ = stored.split("$")
+    return hmac.compare_digest(hash_password(password, bytes.fromhex(salt), int(iterations)), stored)
+
+def is_legacy(stored: str) -> bool:
+    # Rows written before hashing hold the plain password
+    return isinstance(stored, str) and not stored.startswith(f"{ALGORITHM}$")
+
+def verify_legacy(password: str, stored: str) -> bool:
+    return hmac.compare_digest(password.encode(), stored.encode())
+
+def key(filename: str) -> bytes:
+    # Kept on disk so tokens stay valid across a server restart
+    try:
+        return checkpoint.read(filename)
+    except FileNotFoundError:
+        data = secrets.token_bytes(32)
+        checkpoint.write(filename, data)
+        return data
+
+class Sessions:
+    # Signed uid.expiry tokens, those already seen are answered from the table without rechecking
+    LIFETIME = 7 * 24 * 3600
+    SIZE = 4096
+
+    def __init__(self, key: bytes):
+        self.key = key
+        self._table: dict[str, tuple[int, int]] = {}
+
+    def sign(self, body: str) -> str:
+        return hmac.new(self.key, body.encode(), hashlib.sha256).hexdigest()
+
+    def create(self, uid: int) -> str:
+        expires = int(time.time()) + self.LIFETIME
+        body = f"{uid}.{expires}"
+        token = f"{body}.{self.sign(body)}"
+        self._add(token, uid, expires)
+        return token
+
+    def verify(self, token: str) -> int:
+        now = time.time()
+        if (entry := self._table.get(token)) is not None:
+            if entry[1] > now:
+                return entry[0]
+            del self._table[token]
+            return None
+        try:
+            uid, expires, signature = token.split(".")
+            uid, expires = int(uid), int(expires)
+        except (AttributeError, ValueError):
+            return None
+        if expires <= now or not hmac.compare_digest(self.sign(f"{uid}.{expires}"), signature):
+            return None
+        self._add(token, uid, expires)
+        return uid
+
+    def _add(self, token: str, uid: int, expires: int):
+        if len(self._table) >= self.SIZE:
+            now = time.time()
+            self._table = {k: v for k, v in self._table.items() if v[1] > now}
+            if len(self._table) >= self.SIZE:
+                self._table.pop(next(iter(self._table)))
+        self._table[token] = (uid, expires)
@@ -0,0 +1,139 @@
+import game
+import json
+import time
+import neural
+import weights
+import platform
+import importlib
+import multiprocessing as mp
+
+# Training throughput benchmarks, results are written as JSON
+
+SCORE_CAP = 60 * 20
+
+def load(name: str) -> game.GameApplication:
+    return importlib.import_module(f"games.g_{name}.main").main
+
+def _simulate(name: str, windowed: bool) -> tuple[int, float, float]:
+    main = load(name)
+    main.windowed = windowed
+    start = time.perf_counter()
+    game.run_train_ai(main, main.AI, 1, SCORE_CAP, 0)
+    return main.steps, main.TIMESTEP, time.perf_counter() - start
+
+def bench_simulation(name: str, windowed: bool=False) -> dict:
+    # A fresh process per run, a headless run pins engine.core.DeltaTime for the rest of its process
+    with mp.get_context("spawn").Pool(1) as pool:
+        steps, timestep, elapsed = pool.apply(_simulate, (name, windowed))
+    return {
+        "steps": steps,
+        "seconds": elapsed,
+        "steps_per_second": steps / elapsed,
+        "simulated_per_second": steps * timestep / elapsed,
+    }
+
+def bench_feed(name: str, count: int=10000) -> dict:
+    ai = load(name).AI
+    data = [0.5] * len(weights.shape(ai).inputs)
+    start = time.perf_counter()
+    for _ in range(count):
+        ai.feed(*data)
+    elapsed = time.perf_counter() - start
+    return {"feeds": count, "seconds": elapsed, "feeds_per_second": count / elapsed}
+
+def bench_parity(name: str) -> dict:
+    # weights.Batch against neural.Network.feed on the bundled network, with the simulator's input count
+    from games.g_dino import batch
+    return {"max_error": weights.parity(load(name).AI, batch.INPUTS)}
+
+def bench_generation(name: str, population: int, simultaneous: int, generations: int, windowed: bool=False) -> dict:
+    main = load(name)
+    algo = neural.algorithm.Genetic(main.AI, population, 0.8, 0.2)
+    with game.Trainer(type(main).__module__, simultaneous, 1, SCORE_CAP, windowed) as trainer:
+        trainer.cache = game.FitnessCache(0)
+        latency = []
+        for generation in range(generations):
+            trainer.seed = generation
+            start = time.perf_counter()
+            trainer.run(algo, timeout=600)
+            latency.append(time.perf_counter() - start)
+    return {
+        "generations": generations,
+        "latency": latency,
+        "mean_latency": sum(latency) / generations,
+        "evaluations_per_second": population * generations / sum(latency),
+        "stragglers": trainer.stragglers,
+    }
+
+def bench_batch(population: int, generations: int) -> dict:
+    from games.g_dino import batch
+    algo = neural.algorithm.Genetic(load("dino").AI, population, 0.8, 0.2)
+    trainer = batch.Trainer(1, SCORE_CAP / 20)
+    trainer.cache = game.FitnessCache(0)
+    latency = []
+    for generation in range(generations):
+        trainer.seed = generation
+        start = time.perf_counter()
+        trainer.run(algo)
+        latency.append(time.perf_counter() - start)
+    return {
+        "generations": generations,
+        "latency": latency,
+        "mean_latency": sum(latency) / generations,
+        "evaluations_per_second": population * generations / sum(latency),
+    }
+
+def run(args) -> dict:
+    modes = ("headless", "windowed") if args.windowed else ("headless",)
+    results = []
+    def record(name: str, benchmark: str, func, *fargs, **info):
+        entry = {"game": name, "benchmark": benchmark, **info}
+        try:
+            entry.update(func(*fargs))
+        except Exception as e:
+            entry["error"] = f"{type(e).__name__}: {e}"
+        print(json.dumps(entry), flush=True)
+        results.append(entry)
+
+    for name in args.games:
+        record(name, "feed", bench_feed, name)
+        for mode in modes:
+            record(name, "simulation", bench_simulation, name, mode == "windowed", mode=mode)
+            for population in args.population:
+                for simultaneous in args.simultaneous:
+                    record(name, "generation", bench_generation, name, population, simultaneous, args.generations, mode == "windowed",
+                        mode=mode, population=population, simultaneous=simultaneous)
+        if name == "dino":
+            record(name, "parity", bench_parity, name)
+            for population in args.population:
+                record(name, "generation", bench_batch, population, args.generations, mode="batch", population=population)
+
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "headless": game.HEADLESS, # False means every "headless" result above ran with a window
+        "time": time.time(),
+        "results": results,
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Training Throughput Benchmarks")
+    parser.add_argument("-g", "--games", dest="games", nargs="+", default=["dino"],
+        help="Games to Benchmark, only dino has a Trainable GameApplication")
+    parser.add_argument("-n", "--population", dest="population", type=int, nargs="+", default=[12, 48],
+        help="Population Sizes")
+    parser.add_argument("-j", "--simultaneous", dest="simultaneous", type=int, nargs="+", default=[1, 4, 12],
+        help="Simultaneous Games")
+    parser.add_argument("--generations", dest="generations", type=int, default=3,
+        help="Generations per Run")
+    parser.add_argument("--windowed", dest="windowed", action="store_true",
+        help="Also Benchmark Windowed Runs")
+    parser.add_argument("-o", "--out", dest="out", type=str,
+        help="JSON Output File")
+    args = parser.parse_args()
+    report = run(args)
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump(report, file, indent=2)
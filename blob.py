@@ -0,0 +1,113 @@
+import os
+import json
+import zlib
+import asyncio
+import hashlib
+import checkpoint
+from collections import namedtuple, OrderedDict
+
+__all__ = ["Blob", "digest", "pack", "unpack", "Store", "Cache"]
+
+Blob = namedtuple("Blob", ("hash", "data", "size"))
+
+def digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def pack(data: bytes) -> Blob:
+    return Blob(digest(data), zlib.compress(data, 9), len(data))
+
+def unpack(hash: str, data: bytes) -> bytes:
+    raw = zlib.decompress(data)
+    if digest(raw) != hash:
+        raise ValueError("Blob Hash Mismatch")
+    return raw
+
+class Store:
+    # Compressed file contents held up to size bytes in LRU order
+    # Freshness and identity come from the catalogue, a changed hash there means a new blob
+
+    def __init__(self, catalogue, size: int=64 << 20):
+        self.catalogue = catalogue
+        self.size = size
+        self.used = 0
+        self._data: OrderedDict[str, Blob] = OrderedDict()
+        self._loading: dict[tuple[str, str], asyncio.Future] = {}
+
+    @staticmethod
+    def _load(file) -> Blob:
+        # The catalogue hash is reused unless the file changed since it was indexed
+        with open(file.path, "rb") as handle:
+            st = os.fstat(handle.fileno())
+            data = handle.read()
+        if (st.st_size, st.st_mtime) != (file.size, file.mtime):
+            return pack(data)
+        return Blob(file.hash, zlib.compress(data, 9), len(data))
+
+    def _put(self, filename: str, blob: Blob) -> Blob:
+        self.invalidate(filename)
+        self._data[filename] = blob
+        self.used += len(blob.data)
+        while self.used > self.size and len(self._data) > 1:
+            self.invalidate(next(iter(self._data)))
+        return blob
+
+    async def aget(self, filename: str) -> Blob:
+        # Misses are read and compressed in the default executor, concurrent misses share one load
+        await self.catalogue.arefresh()
+        if (file := self.catalogue.entry(filename)) is None:
+            self.invalidate(filename)
+            raise FileNotFoundError(filename)
+        if (blob := self._data.get(filename)) is not None and blob.hash == file.hash:
+            self._data.move_to_end(filename)
+            return blob
+        key = (filename, file.hash)
+        if (future := self._loading.get(key)) is None:
+            future = self._loading[key] = asyncio.get_running_loop().run_in_executor(None, self._load, file)
+            try:
+                return self._put(filename, await future)
+            except FileNotFoundError:
+                # Removed since the last catalogue refresh
+                self.invalidate(filename)
+                raise
+            finally:
+                del self._loading[key]
+        return await asyncio.shield(future)
+
+    def invalidate(self, filename: str=None):
+        if filename is None:
+            self._data.clear()
+            self.used = 0
+        elif (blob := self._data.pop(filename, None)) is not None:
+            self.used -= len(blob.data)
+
+class Cache:
+    # Content addressed files on disk, indexed by the download they came from
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self.path("index.json"), "r") as file:
+                self.index: dict[str, str] = json.load(file)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def path(self, hash: str) -> str:
+        return f"{self.directory}{hash}"
+
+    def known(self, key: str) -> str:
+        if (hash := self.index.get(key)) and os.path.exists(self.path(hash)):
+            return hash
+        return None
+
+    def read(self, key: str) -> bytes:
+        if hash := self.known(key):
+            with open(self.path(hash), "rb") as file:
+                return file.read()
+        return None
+
+    def write(self, key: str, hash: str, data: bytes):
+        if not os.path.exists(self.path(hash)):
+            checkpoint.write(self.path(hash), data)
+        self.index[key] = hash
+        checkpoint.write(self.path("index.json"), json.dumps(self.index).encode())
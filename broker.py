@@ -0,0 +1,124 @@
+import db
+import asyncio
+import logging
+import itertools
+import threading
+import multiprocessing as mp
+from interface import Interface
+
+__all__ = ["Writer", "serve", "Broker"]
+
+# A single process owns every database write for the server workers
+# Requests: (worker, id, op, args), replies: ("reply", id, result), a broadcast (op, *args) or ("stop",)
+
+log = logging.getLogger("broker")
+
+class Writer:
+    # Worker side, forwards writes to the broker and applies its broadcasts to the local leaderboard
+
+    def __init__(self, index: int, requests: mp.Queue, replies: mp.Queue):
+        self.index = index
+        self.requests = requests
+        self.replies = replies
+        self._ids = itertools.count()
+        self._pending: dict[int, asyncio.Future] = {}
+        self._thread: threading.Thread = None
+
+    def start(self, database: db.Database, stop):
+        self.database = database
+        self.stop = stop
+        self.loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._listen, daemon=True)
+        self._thread.start()
+
+    def send(self, op: str, *args):
+        self.requests.put((self.index, None, op, args))
+
+    async def call(self, op: str, *args):
+        id = next(self._ids)
+        future = self._pending[id] = self.loop.create_future()
+        self.requests.put((self.index, id, op, args))
+        return await future
+
+    def _listen(self):
+        while (message := self.replies.get()) is not None:
+            self.loop.call_soon_threadsafe(self._apply, message)
+
+    def _apply(self, message: tuple):
+        op, *args = message
+        if op == "reply":
+            id, result = args
+            if (future := self._pending.pop(id, None)) is not None and not future.done():
+                future.set_result(result)
+        elif op == "score":
+            self.database.leaderboard.add(None, *args)
+        elif op == "stop":
+            self.stop()
+        elif op == "user":
+            uid, name = args
+            self.database.leaderboard.users[uid] = name
+
+    def close(self):
+        self.replies.put(None)
+
+def serve(requests: mp.Queue, replies: list[mp.Queue], level: int=logging.INFO):
+    # A spawned process starts without the parent's logging setup
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def broadcast(*message):
+        for queue in replies:
+            queue.put(message)
+
+    async def main():
+        database = db.Database()
+        loop = asyncio.get_running_loop()
+        async with database:
+            while (message := await loop.run_in_executor(None, requests.get)) is not None:
+                worker, id, op, args = message
+                try:
+                    if op == "score":
+                        await database.queue_score(*args)
+                        broadcast("score", *args)
+                    elif op == "password":
+                        await database.set_password(*args)
+                    elif op == "register":
+                        uid = await database.insert_user(*args)
+                        broadcast("user", uid, args[0])
+                        replies[worker].put(("reply", id, uid))
+                    else:
+                        raise ValueError(f"Unknown Operation: {op}")
+                except Exception:
+                    log.exception("Write Failed: %s", op)
+                    if id is not None:
+                        replies[worker].put(("reply", id, None))
+        Interface.stop()
+    Interface.schedule(main())
+    Interface.main()
+
+class Broker:
+    # Parent side, starts the database process and hands out one Writer per worker
+
+    def __init__(self, workers: int):
+        # Spawned rather than forked, the parent is running the event loop
+        context = mp.get_context("spawn")
+        self.requests = context.Queue()
+        self.replies = [context.Queue() for _ in range(workers)]
+        self.proc = context.Process(target=serve, args=(self.requests, self.replies, logging.getLogger().getEffectiveLevel()))
+
+    def writer(self, index: int) -> Writer:
+        return Writer(index, self.requests, self.replies[index])
+
+    def start(self):
+        self.proc.start()
+
+    def shutdown(self):
+        # Each worker ends its serving loop, flushes its queued requests and exits on its own
+        for queue in self.replies:
+            queue.put(("stop",))
+
+    def stop(self, timeout: float=10):
+        # The sentinel lets the broker flush its queued scores before exiting
+        self.requests.put(None)
+        self.proc.join(timeout)
+        if self.proc.is_alive():
+            self.proc.terminate()
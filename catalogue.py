@@ -0,0 +1,123 @@
+import os
+import time
+import blob
+import asyncio
+import configparser
+from path import PATH
+from collections import namedtuple
+
+__all__ = ["File", "Game", "Catalogue", "catalogue"]
+
+File = namedtuple("File", ("path", "size", "mtime", "hash"))
+Game = namedtuple("Game", ("name", "folder", "main", "ais", "nets"))
+
+def stat(filename: str) -> tuple[int, float]:
+    try:
+        st = os.stat(filename)
+        return st.st_size, st.st_mtime
+    except OSError:
+        return None
+
+class Catalogue:
+    # Index of every g_* game folder, rescanned only when a polled mtime changes
+    POLL = 2.0
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.games: dict[str, Game] = {}
+        self._files: dict[str, File] = {}
+        self._stamp: dict[str, float] = {}
+        self._checked = None
+        self._refreshing: asyncio.Future = None
+
+    def file(self, filename: str) -> File:
+        # The hash is only recomputed when size or mtime change
+        if (st := stat(filename)) is None:
+            return None
+        if (old := self._files.get(filename)) is not None and (old.size, old.mtime) == st:
+            return old
+        with open(filename, "rb") as file:
+            self._files[filename] = File(filename, *st, blob.digest(file.read()))
+        return self._files[filename]
+
+    def _scan(self, folder: str) -> Game:
+        path = f"{self.directory}g_{folder}/"
+        if (main := self.file(f"{path}main.py")) is None:
+            return None
+        ais = {}
+        if os.path.exists(f"{path}ai.cfg"):
+            cfg = configparser.ConfigParser()
+            cfg.optionxform = str # Keep the case of AI names
+            cfg.read(f"{path}ai.cfg")
+            if cfg.has_section("ai"):
+                ais = dict(cfg["ai"])
+        nets = {}
+        if os.path.isdir(f"{path}net"):
+            for filename in sorted(os.listdir(f"{path}net")):
+                if (net := self.file(f"{path}net/{filename}")) is not None:
+                    nets[filename] = net
+        return Game(folder, path, main, ais, nets)
+
+    def _stamps(self) -> dict[str, float]:
+        # Directory mtimes change on add, remove or rename, file mtimes on write
+        stamps = {self.directory: os.stat(self.directory).st_mtime}
+        for entry in os.listdir(self.directory):
+            if not entry.startswith("g_"):
+                continue
+            path = f"{self.directory}{entry}/"
+            for name in ("", "main.py", "ai.cfg", "net/"):
+                if (st := stat(path + name)) is not None:
+                    stamps[path + name] = st[1]
+            if os.path.isdir(f"{path}net"):
+                for filename in os.listdir(f"{path}net"):
+                    if (st := stat(f"{path}net/{filename}")) is not None:
+                        stamps[f"{path}net/{filename}"] = st[1]
+        return stamps
+
+    def refresh(self, force: bool=False) -> bool:
+        now = time.monotonic()
+        if not force and self._checked is not None and now - self._checked < self.POLL:
+            return False
+        self._checked = now
+        stamps = self._stamps()
+        if stamps == self._stamp:
+            return False
+        self._stamp = stamps
+        games = {}
+        for entry in sorted(os.listdir(self.directory)):
+            if entry.startswith("g_") and (game := self._scan(entry[2:])) is not None:
+                games[game.name] = game
+        self.games = games
+        self._files = {k: v for k, v in self._files.items() if k in stamps}
+        return True
+
+    async def arefresh(self, force: bool=False) -> bool:
+        # The stats and any rehashing run in the executor, concurrent callers share one scan
+        if not force and self._checked is not None and time.monotonic() - self._checked < self.POLL:
+            return False
+        if self._refreshing is None:
+            self._refreshing = asyncio.get_running_loop().run_in_executor(None, self.refresh, force)
+            try:
+                return await self._refreshing
+            finally:
+                self._refreshing = None
+        return await asyncio.shield(self._refreshing)
+
+    def entry(self, filename: str) -> File:
+        # As of the last refresh, without touching the disk
+        return self._files.get(filename)
+
+    def names(self) -> list[str]:
+        self.refresh()
+        return list(self.games)
+
+    def game(self, folder: str) -> Game:
+        self.refresh()
+        return self.games.get(folder)
+
+    def ai(self, folder: str, filename: str) -> File:
+        if (game := self.game(folder)) is None:
+            return None
+        return game.nets.get(filename)
+
+catalogue = Catalogue(PATH + "games/")
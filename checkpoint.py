@@ -0,0 +1,61 @@
+import os
+import json
+
+__all__ = ["Log", "write", "read"]
+
+def write(filename: str, data: bytes):
+    # Readers only ever see the old or the new file, never a partial write
+    tmp = f"{filename}.tmp"
+    with open(tmp, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, filename)
+
+def read(filename: str) -> bytes:
+    with open(filename, "rb") as file:
+        return file.read()
+
+class Log:
+    # Append only training log with one JSON record per line
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.count = 0
+        self.last: dict = None
+        end = 0
+        try:
+            with open(self.filename, "rb") as file:
+                for line in file:
+                    # Only the final record can be torn by a crash, it has no newline yet
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        self.last = json.loads(line)
+                    except ValueError:
+                        raise ValueError(f"Corrupt Record {self.count} in {self.filename}") from None
+                    end += len(line)
+                    self.count += 1
+        except FileNotFoundError:
+            pass
+        self._file = open(self.filename, "ab")
+        # Drop the torn record so the next append starts on a clean line
+        self._file.truncate(end)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, record: dict):
+        self._file.write(json.dumps(record).encode() + b"\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.count += 1
+        self.last = record
+
+    def close(self):
+        self._file.close()
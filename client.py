@@ -1,13 +1,16 @@
 import gui
+import blob
 import enum
 import game
 import node
 import asyio
+import asyncio
 import loader
 import caching
 import website
 import functools
 import webbrowser
+from path import PATH
 from interface import Interface
 from collections import namedtuple
 from typing import Callable, Any
@@ -15,6 +18,11 @@ from typing import Callable, Any
 class Requests(node.Client):
     def __init__(self, addr: str, port: int):
         super().__init__(addr, port)
+        self.cache = blob.Cache(f"{PATH}cache/")
+        self._tag = 0
+        self.token: str = None
+        self.uid: int = None
+        self.ready = asyncio.Event() # Set once open has finished, with uid from its login
 
     def is_open(func):
         async def only_check_cache_if_open(self, *args, **kwargs):
@@ -24,65 +32,98 @@ class Requests(node.Client):
         return only_check_cache_if_open
 
     async def open(self):
-        if not (await super().open()):
+        self.ready.clear()
+        self.uid = None
+        try:
+            if not (await super().open()):
+                return False
+            cfg = website.config("client.cfg")
+            self.send(cfg["connection"]["password"], "PASSWORD")
+            if not (await self.recv("PASSWORD"))[0].data:
+                print("Password: Incorrect")
+                print("Connection Closed")
+                return not await self.close()
+            if self.token is None or (uid := await self.resume()) is None:
+                uid = await self.login(cfg["user"]["name"], cfg["user"]["password"])
+            self.uid = uid
+        finally:
+            self.ready.set()
+
+    def next_tag(self) -> node.Tag:
+        # Every request carries its own tag, so any number can be in flight on one connection
+        self._tag += 1
+        return node.Tag(self._tag)
+
+    async def request(self, data, channel: str) -> node.Data:
+        tag = self.next_tag()
+        self.send(data, channel, tag)
+        if response := await self.recv(channel, tag):
+            return response[0]
+        return None
+
+    async def fetch(self, channel: str, id: int) -> bytes:
+        # Sends the hash of the cached copy so unchanged files are not resent
+        key = f"{self.addr}:{self.port}/{channel}/{id}"
+        known = self.cache.known(key)
+        if not self:
+            return self.cache.read(key) or False # Offline
+        tag = self.next_tag()
+        self.send((id, known), channel, tag)
+        if not (data := await self.recv(channel, tag)) or data[0].data is False:
             return False
-        cfg = website.config("client.cfg")
-        self.send(cfg["connection"]["password"], "PASSWORD")
-        if not (await self.recv("PASSWORD"))[0].data:
-            print("Password: Incorrect")
-            print("Connection Closed")
-            return not await self.close()
-        await self.login(cfg["user"]["name"], cfg["user"]["password"])
-
-    @is_open
-    @caching.cache(1, 5)
-    async def download(self, game: int):
+        if data[0].data is True:
+            return self.cache.read(key)
+        hash, compressed = data[0].data
+        if isinstance(compressed, int): # Chunked
+            if len(chunks := await self.recv(channel, tag, wait=compressed)) != compressed:
+                return False
+            compressed = b"".join(chunk.data for chunk in chunks)
+        raw = blob.unpack(hash, compressed)
+        self.cache.write(key, hash, raw)
+        return raw
+
+    async def download(self, game: int) -> bytes:
         print("Download:", game)
-        self.send(game, "GAME")
-        data = await self.recv("GAME", node.Tag(game))
-        if data and data[0].data:
-            loader.write_game(data[0].data)
-            return True
-        return False
+        return await self.fetch("GAME", game)
 
-    @is_open
-    @caching.cache(1, 5)
     async def download_ai(self, ai: int) -> bytes:
         print("Download AI:", ai)
-        self.send(ai, "AI")
-        data = await self.recv("AI", node.Tag(ai))
-        if data and data[0].data:
-            return data[0].data
-        return False
+        return await self.fetch("AI", ai)
 
     @is_open
     @caching.cache(1, 5)
     async def retrieve_list(self) -> list[tuple[int, str]]:
         print("Retrieve List")
-        self.send(b"", "GLIST")
-        count = await self.recv("GLIST")
-        if count:
-            return [i.data for i in await self.recv("GLIST", wait=count[0].data)]
+        if data := await self.request(b"", "GLIST"):
+            return [tuple(i) for i in data.data]
 
     @is_open
     @caching.cache(1, 15)
     async def retrieve_net_list(self, game: int) -> list[tuple[int, str]]:
         print("Retrieve AI List")
-        self.send(game, "AILIST")
-        count = await self.recv("AILIST", node.Tag(game))
-        if count:
-            return [i.data for i in await self.recv("AILIST", node.Tag(game), wait=count[0].data)]
+        if data := await self.request(game, "AILIST"):
+            return [tuple(i) for i in data.data]
 
     async def send_score(self, gid: int, aid: int, uid: int, value: int):
         self.send(uid, "DATABASE", node.Tag(gid), node.Tag(aid))
         await self.send(value, "DATABASE_VALUE", node.Tag(gid), node.Tag(aid), node.Tag(uid))
 
     @is_open
-    @caching.cache(1, 30)
     async def login(self, name: str, password: str) -> int:
-        self.send(name, "LOGIN")
+        tag = self.next_tag()
+        self.send(name, "LOGIN", tag)
         self.send(password, "LOGIN_PASSWORD")
-        return (await self.recv("LOGIN"))[0].data
+        if data := await self.recv("LOGIN", tag):
+            uid, self.token = data[0].data
+            return uid
+
+    @is_open
+    async def resume(self) -> int:
+        # The session token from an earlier login, None once it has expired
+        if data := await self.request(self.token, "SESSION"):
+            if data.data is None:
+                self.token = None
+            return data.data
 
 class GuiApplication:
 
@@ -278,7 +319,7 @@ class Client:
 
     async def _load_game(self, gid: int, name: str, net: int):
         downloads = await Interface.gather(self.net.download(gid), self.net.download_ai(net))
-        if all(downloads) and self.games.reload():
+        if all(downloads) and self.games.load(downloads[0]):
             self.games.set_ai(downloads[1])
             self.games.active = name
             self.games.get().main._id = gid
@@ -306,10 +347,10 @@ class Client:
         await self.net.send_score(self.games.get().main._id, self.games.ai._id, self.user.id, score)
 
     async def _login(self):
-        cfg = website.config("client.cfg")["user"]
-        name = cfg["name"]
-        res = await self.net.login(name, cfg["password"])
-        self.user = User(1 if res is None else res, name)
+        # Reuses the login done by net.open rather than sending a second one
+        name = website.config("client.cfg")["user"]["name"]
+        await self.net.ready.wait()
+        self.user = User(1 if self.net.uid is None else self.net.uid, name)
         self.guiapp.call(lambda: self.guiapp.window["settings"].show())
 
 def main(addr: str):
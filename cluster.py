@@ -0,0 +1,234 @@
+import game
+import node
+import asyncio
+import neural
+import collections
+import multiprocessing as mp
+from interface import Interface
+
+class TrainClient(node.SClient):
+    # Coordinator side of a connected worker
+
+    async def open(self):
+        await super().open()
+        self.slots = 0
+        self.authorized = False
+        self.jobs: dict[tuple[int, int], neural.Network] = {} # (generation, index), older generations included
+        self.authorized = (await self.recv("PASSWORD"))[0].data == self.server.password
+        await self.send(self.authorized, "PASSWORD")
+        if not self.authorized:
+            print("Worker Refused:", self._node)
+            return await self.close()
+        self.send(self.server.config, "TRAIN_CONFIG")
+        print("Worker:", self._node)
+
+    async def close(self):
+        self.server.leave(self)
+        return await super().close()
+
+    async def dsptch_train_ready(self, data: node.Data):
+        if not self.authorized:
+            return
+        self.slots = data.data
+        self.server.join(self)
+
+    async def dsptch_train_result(self, data: node.Data):
+        if not self.authorized:
+            return
+        generation, index = map(int, data.tag)
+        self.jobs.pop((generation, index), None)
+        self.server.result(generation, index, data.data)
+
+class Coordinator(node.Server):
+    # Hands genome evaluations to remote workers over the node protocol
+
+    def __init__(self, port: int, password: str, module: str, iterations: int=3, score_cap: float=None, capacity: int=1024):
+        self.password = password
+        self.config = (module, iterations, score_cap)
+        self.generation = 0
+        self.seed = None
+        self.workers: set[TrainClient] = set()
+        self._pending: collections.deque[tuple[int, neural.Network]] = collections.deque()
+        self._scores: list[float] = []
+        self._done = asyncio.Event()
+        super().__init__("", port, capacity, TrainClient)
+
+    def join(self, worker: TrainClient):
+        self.workers.add(worker)
+        self._dispatch()
+
+    def leave(self, worker: TrainClient):
+        # Jobs held by a dropped worker go back to the front of the queue
+        self.workers.discard(worker)
+        self._pending.extendleft((index, nn) for (generation, index), nn in worker.jobs.items()
+            if generation == self.generation and self._scores[index] is None)
+        worker.jobs.clear()
+        self._dispatch()
+
+    def result(self, generation: int, index: int, score: tuple[float, float]):
+        if generation != self.generation or self._scores[index] is not None:
+            return
+        self._scores[index] = score
+        if None not in self._scores:
+            self._done.set()
+        self._dispatch()
+
+    def _dispatch(self):
+        # Jobs from a timed out generation still hold their slot until the worker answers
+        for worker in tuple(self.workers):
+            while self._pending and len(worker.jobs) < worker.slots:
+                index, nn = self._pending.popleft()
+                if self._scores[index] is not None:
+                    continue
+                worker.jobs[(self.generation, index)] = nn
+                worker.send((nn, self.seed), "TRAIN", node.Tag(self.generation), node.Tag(index))
+
+    async def run(self, population: list[neural.Network], seed=None, timeout: int=60) -> list[tuple[float, float]]:
+        self.generation += 1
+        self.seed = seed
+        self._scores = [None] * len(population)
+        self._pending = collections.deque(enumerate(population))
+        self._done.clear()
+        if not population:
+            return self._scores # Every genome was a fitness cache hit
+        self._dispatch()
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._pending.clear()
+        return self._scores
+
+class TrainWorker(node.Client):
+
+    def __init__(self, addr: str, port: int, password: str, simultaneous: int=None):
+        super().__init__(addr, port)
+        self.password = password
+        self.simultaneous = simultaneous
+        self.trainer: game.Trainer = None
+
+    async def open(self):
+        if not (await super().open()):
+            return False
+        self.send(self.password, "PASSWORD")
+        if not (await self.recv("PASSWORD"))[0].data:
+            print("Password: Incorrect")
+            return not await self.close()
+        return True
+
+    async def close(self):
+        if self.trainer:
+            self.trainer.close()
+            self.trainer = None
+        return await super().close()
+
+    async def dsptch_train_config(self, data: node.Data):
+        if self.trainer:
+            self.trainer.close()
+        module, iterations, score_cap = data.data
+        self.trainer = game.Trainer(module, self.simultaneous, iterations, score_cap)
+        self.trainer.open()
+        self.send(self.simultaneous or mp.cpu_count(), "TRAIN_READY")
+
+    async def dsptch_train(self, data: node.Data):
+        score = await self.trainer.evaluate(*data.data)
+        self.send(score, "TRAIN_RESULT", *map(node.Tag, data.tag))
+
+class Cluster:
+    # Drop in replacement for game.Trainer which evaluates on remote workers
+
+    def __init__(self, port: int, password: str, module: str, iterations: int=3, score_cap: float=None):
+        self.coordinator = Coordinator(port, password, module, iterations, score_cap)
+        self.score_cap = score_cap
+        self.stragglers = 0
+        self.scores: list[float] = []
+        self.seed = None
+        self.cache = game.FitnessCache()
+
+    def open(self):
+        Interface.schedule(self.coordinator.__aenter__()).result()
+    def close(self):
+        Interface.schedule(self.coordinator.__aexit__(None, None, None)).result()
+
+    def run(self, algorithm: neural.algorithm.Genetic, timeout: int=60) -> float:
+        population = list(algorithm.population())
+        keys, scores = self.cache.lookup(population, self.seed)
+        jobs = [i for i, score in enumerate(scores) if score is None]
+        results = Interface.schedule(self.coordinator.run([population[i] for i in jobs], self.seed, timeout)).result()
+        for index, res in zip(jobs, results):
+            if res is not None:
+                scores[index] = 0 if res[0] is None else res[0]
+                self.cache.put(keys[index], scores[index], res[1])
+        self.stragglers = scores.count(None)
+        s, self.scores = game.merge(algorithm, population, scores, self.score_cap)
+        return s
+
+def work(addr: str, port: int, password: str, simultaneous: int=None):
+    async def main():
+        worker = TrainWorker(addr, port, password, simultaneous)
+        while not (await worker.open()):
+            await Interface.next(1)
+        while worker:
+            await Interface.next(1)
+        await worker.close()
+        Interface.stop()
+    Interface.schedule(main())
+    Interface.main()
+
+def spawn(count: int, port: int, password: str, simultaneous: int=None) -> list[mp.Process]:
+    # Local workers on the loopback interface
+    # Spawned so the workers do not inherit the running Interface loop
+    context = mp.get_context("spawn")
+    procs = [context.Process(target=work, args=("127.0.0.1", port, password, simultaneous)) for _ in range(count)]
+    for proc in procs:
+        proc.start()
+    return procs
+
+def loopback(count: int, port: int, password: str, population: int=24, generations: int=3, timeout: int=60):
+    # Coordinator and count workers on loopback, one JSON line per generation
+    import json
+    import time
+    from games.g_dino.main import main
+
+    algo = neural.algorithm.Genetic(main.AI, population, 0.8, 0.2)
+    trainer = Cluster(port, password, main.__module__, 1, 60 * 20)
+    trainer.open()
+    procs = spawn(count, port, password, 1)
+    try:
+        for generation in range(generations):
+            trainer.seed = generation
+            start = time.perf_counter()
+            score = trainer.run(algo, timeout)
+            print(json.dumps({
+                "generation": generation,
+                "workers": len(trainer.coordinator.workers),
+                "score": score,
+                "stragglers": trainer.stragglers,
+                "seconds": time.perf_counter() - start,
+            }), flush=True)
+    finally:
+        trainer.close()
+        for proc in procs:
+            proc.terminate()
+
+if __name__ == "__main__":
+    import argparse
+    import website
+
+    parser = argparse.ArgumentParser(description="Training Worker")
+    parser.add_argument("-a", "--addr", dest="addr", type=str, default="127.0.0.1",
+        help="Coordinator IPv4 Address")
+    parser.add_argument("-p", "--port", dest="port", type=int, default=612,
+        help="Coordinator Port Number")
+    parser.add_argument("-j", "--simultaneous", dest="simultaneous", type=int,
+        help="Games to Evaluate at once")
+    parser.add_argument("--loopback", dest="loopback", type=int,
+        help="Coordinate this many Local Workers as a Self Test")
+    args = parser.parse_args()
+    password = website.config("server.cfg", write=False)["server"]["password"]
+    if args.loopback:
+        with Interface.main_thread():
+            loopback(args.loopback, args.port, password)
+        Interface.stop()
+    else:
+        work(args.addr, args.port, password, args.simultaneous)
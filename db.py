@@ -1,14 +1,35 @@
 from path import PATH
 from single import Singleton
 import database as db
+import auth
+import sqlite3
+import asyncio
+import logging
+import contextlib
 import loader
+import leaderboard
 
 __all__ = ["Database"]
 
+log = logging.getLogger("db")
+
 class Database(metaclass=Singleton):
 
+    # Write-behind score batching
+    FLUSH_DELAY = 0.005
+    FLUSH_ROWS = 256
+    FLUSH_RETRY = 1.0
+
+    # Created at every startup, so databases made before an index was added gain it too
+    INDEXES = (("User", "name"), ("Score", "value"), ("Score", "aid"), ("Score", "uid"), ("AI", "gid"))
+
     def __init__(self):
-        self._db = db.DatabaseAsync(PATH+"database.db")
+        self._path = PATH+"database.db"
+        self._db = db.DatabaseAsync(self._path)
+        self.leaderboard = leaderboard.Leaderboard()
+        self._scores: list[tuple[int, int, int]] = []
+        self._flush_timer: asyncio.Task = None
+        self.writer = None # broker.Writer when writes go through the database process
 
     def new(self):
         self._db.new()
@@ -18,10 +39,23 @@ class Database(metaclass=Singleton):
         game = await self._db.table("Game", db.Column("name", db.tp.STR, db.tp.NULL), db.Column("folder", db.tp.STR, db.tp.NULL))
         ai = await self._db.table("AI", db.Column.Foreign("gid", game), db.Column("name", db.tp.STR, db.tp.NULL), db.Column("filename", db.tp.STR, db.tp.NULL))
         score = await self._db.table("Score", db.Column.Foreign("uid", user), db.Column.Foreign("aid", ai), db.Column("value", db.tp.INT, db.tp.NULL))
+        await self.indexes()
 
         # Default Users
         await self.register("annon", "annon_user_password")
 
+    async def sql(self, query: str, params=(), many: bool=False) -> list:
+        # Statements the database package has no call for, on their own connection off the event loop
+        def run():
+            with contextlib.closing(sqlite3.connect(self._path, timeout=30)) as conn:
+                with conn:
+                    return (conn.executemany if many else conn.execute)(query, params).fetchall()
+        return await asyncio.get_running_loop().run_in_executor(None, run)
+
+    async def indexes(self):
+        for table, column in self.INDEXES:
+            await self.sql(f'CREATE INDEX IF NOT EXISTS "{table}_{column}" ON "{table}" ("{column}")')
+
     async def _add_games_ai(self, game: tuple[str, str], *ai: tuple[str, str]):
         gid = await self.create_game(*game)
         for i in ai:
@@ -31,12 +65,38 @@ class Database(metaclass=Singleton):
         await self._db.__aenter__()
         return self
     async def __aexit__(self, *args):
+        await self.flush()
         return await self._db.__aexit__(*args)
 
     async def login(self, username: str, password: str) -> int:
-        return (await self._db().select(self._db["User"], db.Condition(username, "name"), db.Condition(password, "password"), cols=["id"]))(1)[0]
+        # None when the user is unknown or the password does not match
+        if not (user := (await self._db().select(self._db["User"], db.Condition(username, "name"), cols=["id", "password"]))(1)):
+            return None
+        loop = asyncio.get_running_loop()
+        if auth.is_legacy(user[1]):
+            # Upgraded to a hash on the first good login
+            if not auth.verify_legacy(password, user[1]):
+                return None
+            await self.set_password(user[0], await loop.run_in_executor(None, auth.hash_password, password))
+            return user[0]
+        if not await loop.run_in_executor(None, auth.verify_password, password, user[1]):
+            return None
+        return user[0]
+
+    async def set_password(self, user: int, hashed: str):
+        if self.writer is not None:
+            return self.writer.send("password", user, hashed)
+        await self.sql('UPDATE "User" SET "password" = ? WHERE "id" = ?', (hashed, user))
     async def register(self, username: str, password: str) -> int:
-        return await self._db().insert(self._db["User"], username, password)
+        # Hashing is deliberately slow so it runs off the event loop
+        hashed = await asyncio.get_running_loop().run_in_executor(None, auth.hash_password, password)
+        if self.writer is not None:
+            return await self.writer.call("register", username, hashed)
+        return await self.insert_user(username, hashed)
+    async def insert_user(self, username: str, hashed: str) -> int:
+        uid = await self._db().insert(self._db["User"], username, hashed)
+        self.leaderboard.users[uid] = username
+        return uid
 
     async def user_exists(self, username: str) -> bool:
         return (await self._db().select(self._db["User"], db.Condition(username, "name"), cols=["id"]))(1)
@@ -52,34 +112,70 @@ class Database(metaclass=Singleton):
         return (await self._db().select(self._db["Ai"], db.Condition(game, "gid"), cols=["id", "name"]))(None)
 
     async def create_game(self, name: str, folder: str) -> int:
-        return await self._db().insert(self._db["Game"], name, folder)
+        gid = await self._db().insert(self._db["Game"], name, folder)
+        self.leaderboard.games[gid] = name
+        return gid
     async def create_ai(self, game: int, name: str, filename: str) -> int:
-        return await self._db().insert(self._db["AI"], game, name, filename)
+        aid = await self._db().insert(self._db["AI"], game, name, filename)
+        self.leaderboard.ais[aid] = (game, name)
+        return aid
     async def create_score(self, user: int, ai: int, score: int):
-        return await self._db("score").insert(self._db["Score"], user, ai, score)
+        # With a writer the leaderboard is updated when the score is broadcast back
+        if self.writer is not None:
+            return self.writer.send("score", user, ai, score)
+        self.leaderboard.add(None, user, ai, score)
+        await self.queue_score(user, ai, score)
+    async def queue_score(self, user: int, ai: int, score: int):
+        self._scores.append((user, ai, score))
+        if self._flush_timer is None:
+            self._flush_timer = asyncio.ensure_future(self._flush_later(0 if len(self._scores) >= self.FLUSH_ROWS else self.FLUSH_DELAY))
+
+    async def _flush_later(self, delay: float):
+        # Failures are logged and retried here, never raised into the client that sent the score
+        await asyncio.sleep(delay)
+        self._flush_timer = None
+        try:
+            await self.flush()
+        except Exception:
+            log.exception("Score Flush Failed: Retrying %s Rows", len(self._scores))
+            if self._flush_timer is None:
+                self._flush_timer = asyncio.ensure_future(self._flush_later(self.FLUSH_RETRY))
+
+    async def flush(self):
+        # Every queued score is written in a single transaction, on failure the rows are queued again
+        rows, self._scores = self._scores, []
+        if not rows:
+            return
+        try:
+            await self.sql('INSERT INTO "Score" ("uid", "aid", "value") VALUES (?, ?, ?)', rows, many=True)
+        except BaseException:
+            self._scores[:0] = rows
+            raise
+
+    async def load_leaderboard(self):
+        # One full pass at startup, create_score keeps it current afterwards
+        board = self.leaderboard = leaderboard.Leaderboard(self.leaderboard.size)
+        board.users.update((await self._db().select(self._db["User"], cols=["id", "name"]))(None))
+        board.games.update((await self._db().select(self._db["Game"], cols=["id", "name"]))(None))
+        board.ais.update((aid, (gid, name)) for aid, gid, name in (await self._db().select(self._db["AI"], cols=["id", "gid", "name"]))(None))
+        for sid, uid, aid, value in (await self._db().select(self._db["Score"], cols=["id", "uid", "aid", "value"]))(None):
+            board.add(sid, uid, aid, value)
 
     async def ai_game(self, id: int) -> list[str, str]:
         return await self.game((await self._db().select(self._db["AI"], id, cols=["gid"]))(1)[0])
 
-    async def score_list(self, type: str="all", data=None):
-        dbi = self._db("get_score")
-        tu, tg, ta, ts = self._db["User"], self._db["Game"], self._db["AI"], self._db["Score"]
-        if type in ("user", "game", "ai"):
-            tb = {"user": tu, "game": tg, "ai": ta}
-            await dbi.select((ts, ta, tg, tu),
-                db.Condition(tb[type]["id"], data),
-                cols=(
-                        tu["name"], tg["name"], ta["name"], ts["value"]
-                ), order=(ts["value"], -1)
-            )
-        else: # All
-            await dbi.select((ts, ta, tg, tu), cols=(
-                tu["name"], tg["name"], ta["name"], ts["value"]
-            ), order=(ts["value"], -1))
+    async def score_list(self, type: str="all", data=None, page: int=0, size: int=50):
+        # Only one page is ever sorted and read, using the Score(value) index
+        # Ties fall back to the newest id, the same order as the leaderboard, so pages never overlap
+        where = {"user": 'WHERE "User"."id" = ?', "game": 'WHERE "Game"."id" = ?', "ai": 'WHERE "AI"."id" = ?'}.get(type, "")
+        rows = await self.sql(f"""
+            SELECT "User"."name", "Game"."name", "AI"."name", "Score"."value" FROM "Score"
+            JOIN "AI" ON "Score"."aid" = "AI"."id"
+            JOIN "Game" ON "AI"."gid" = "Game"."id"
+            JOIN "User" ON "Score"."uid" = "User"."id"
+            {where} ORDER BY "Score"."value" DESC, "Score"."id" DESC LIMIT ? OFFSET ?
+        """, ((data,) if where else ()) + (size, page * size))
 
         SIZE = 10
-        while True:
-            res = dbi.fetch(SIZE)
-            yield res
-            if len(res) < SIZE:
-                break
+        for start in range(0, len(rows), SIZE):
+            yield rows[start:start + SIZE]
@@ -1,7 +1,12 @@
 import enum
 import time
+import random
+import asyncio
 import engine
+import inspect
+import importlib
 import neural
+import weights
 import collections
 import multiprocessing as mp
 from interface import Interface
@@ -13,16 +18,57 @@ class AI_State(enum.IntEnum):
     ACTIVE = 2
     TRAIN = 3
 
+def episode_rng(seed, episode: int=0) -> random.Random:
+    # Every genome given the same seed plays the same sequence of episodes
+    return random.Random(None if seed is None else f"{seed}:{episode}")
+
+def headless_supported() -> bool:
+    # engine is not vendored here, the window keyword is only passed when Application names it itself
+    try:
+        return "window" in inspect.signature(engine.core.Application.__init__).parameters
+    except (TypeError, ValueError):
+        return False
+
+HEADLESS = headless_supported()
+
+def fixed_timestep(step: float):
+    # Training processes only ever run one headless game, so the clock can be pinned globally
+    engine.core.DeltaTime.dt = engine.core.DeltaTime.ph = staticmethod(lambda: step)
+    engine.core.DeltaTime.value = step
+
+class StepCounter(engine.ecs.System):
+
+    def update(self, app: engine.core.Application):
+        app.program.steps += 1
+
 class GameApplication(engine.core.Program):
 
     width, height = 1280, 720
+    TIMESTEP = 1 / 60
     AI: neural.Network = neural.Network(neural.layout.Layout((0,),(0,),[(0,(),neural.neuron.Neuron)]))
     AIState: AI_State = AI_State.NONE
     callback = lambda s: None
+    steps = 0
+    score_cap: float = None
+    variance: float = 0
+    seed = None
+    windowed = False # Train with a window, only for comparison benchmarks
+
+    @property
+    def headless(self) -> bool:
+        return self.AIState is AI_State.TRAIN and not self.windowed and HEADLESS
+
+    def rng(self, episode: int=0) -> random.Random:
+        return episode_rng(self.seed, episode)
 
     def initialize(self, app: engine.core.Application):
-        app.world.systems.add(engine.layer.Data(app.world.systems.type.PRE, engine.ecs.systems.FPS(10), False))
-        app.world.systems.add(engine.layer.Data(app.world.systems.type.RENDER, engine.ecs.systems.Render()))
+        if self.AIState is AI_State.TRAIN:
+            app.world.systems.add(engine.layer.Data(app.world.systems.type.PRE, StepCounter()))
+        if self.headless:
+            fixed_timestep(self.TIMESTEP)
+        else:
+            app.world.systems.add(engine.layer.Data(app.world.systems.type.PRE, engine.ecs.systems.FPS(10), False))
+            app.world.systems.add(engine.layer.Data(app.world.systems.type.RENDER, engine.ecs.systems.Render()))
         app.world.systems.add(engine.layer.Data(app.world.systems.type.SCRIPT, engine.ecs.systems.Script()))
         app.world.systems.add(engine.layer.Data(app.world.systems.type.PHYSICS, engine.ecs.systems.Collider()))
 
@@ -33,7 +79,8 @@ class GameApplication(engine.core.Program):
 def run(game: GameApplication, nn: neural.Network, ai_state: AI_State):
     game.AIState = ai_state
     game.AI = nn
-    app = engine.core.Application(game)
+    game.steps = 0
+    app = engine.core.Application(game, window=not game.headless) if HEADLESS else engine.core.Application(game)
     engine.main(app)
 
 def run_player(game: GameApplication):
@@ -44,21 +91,126 @@ def run_ai(game: GameApplication, ai: neural.Network) -> mp.Process:
     proc.start()
     return proc
 
-def run_train_ai(game: GameApplication, ai: neural.Network, iterations: int):
+def run_train_ai(game: GameApplication, ai: neural.Network, iterations: int, score_cap: float=None, seed=None):
     game.iterations = iterations
+    game.score_cap = score_cap
+    game.seed = seed
+    game.variance = 0
     run(game, ai, AI_State.TRAIN)
     return game.fitness
 
-def __starmap(args):
-    return run_train_ai(*args)
+_worker: GameApplication = None
 
-def run_train(game: GameApplication, algorithm: neural.algorithm.Genetic, iterations: int=3, simultaneous: int=None, timeout: int=60) -> neural.algorithm.Genetic:
-    simultaneous = algorithm.population_size if simultaneous is None else simultaneous
-    with mp.Pool(simultaneous) as pool:
+def _worker_init(module: str, windowed: bool=False):
+    global _worker
+    _worker = importlib.import_module(module).main
+    _worker.windowed = windowed
+
+def _worker_train(args):
+    index, *args = args
+    return index, run_train_ai(_worker, *args), _worker.variance
+
+class FitnessCache:
+    # LRU of (fitness, variance) keyed by the network content and game seed
+    # A score is only reused on the same course: clones within a generation, or across
+    # generations while train.py --reseed keeps the seed, trading generalisation for hits
+
+    def __init__(self, size: int=1024):
+        self.size = size
+        self.hits = self.misses = 0
+        self._data: collections.OrderedDict[bytes, tuple[float, float]] = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def key(self, ai: neural.Network, seed=None) -> bytes:
+        return weights.digest(ai, seed)
+
+    def get(self, key: bytes) -> tuple[float, float]:
         try:
-            scores = pool.map_async(__starmap, ((game, n, iterations) for n in algorithm.population())).get(timeout)
-        except mp.TimeoutError:
+            self._data.move_to_end(key)
+        except KeyError:
+            self.misses += 1
             return None
-    collections.deque(map(algorithm.fitness, algorithm.population(), scores), maxlen=0)
+        self.hits += 1
+        return self._data[key]
+
+    def put(self, key: bytes, fitness: float, variance: float):
+        self._data[key] = (fitness, variance)
+        self._data.move_to_end(key)
+        if len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def lookup(self, population: list[neural.Network], seed=None) -> tuple[list[bytes], list[float]]:
+        keys = [self.key(ai, seed) for ai in population]
+        return keys, [None if (hit := self.get(key)) is None else hit[0] for key in keys]
+
+class Trainer:
+    # Long lived pool of training processes, each imports the game module once
+
+    def __init__(self, module: str, simultaneous: int=None, iterations: int=3, score_cap: float=None, windowed: bool=False):
+        self.module = module
+        self.windowed = windowed
+        self.simultaneous = simultaneous
+        self.iterations = iterations
+        self.score_cap = score_cap
+        self.stragglers = 0
+        self.scores: list[float] = []
+        self.seed = None
+        self.cache = FitnessCache()
+        self._pool: mp.Pool = None
+
+    def __enter__(self):
+        self.open()
+        return self
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self):
+        if not (self.windowed or HEADLESS):
+            print("Headless Unavailable: engine.core.Application Takes no window Argument, Training Runs Windowed")
+        self._pool = mp.Pool(self.simultaneous, _worker_init, (self.module, self.windowed))
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def run(self, algorithm: neural.algorithm.Genetic, timeout: int=60) -> float:
+        population = list(algorithm.population())
+        keys, scores = self.cache.lookup(population, self.seed)
+        jobs = [(i, n, self.iterations, self.score_cap, self.seed) for i, n in enumerate(population) if scores[i] is None]
+        results = self._pool.imap_unordered(_worker_train, jobs)
+        end = time.monotonic() + timeout
+        try:
+            for _ in jobs:
+                index, score, variance = results.next(max(end - time.monotonic(), 0))
+                scores[index] = 0 if score is None else score
+                self.cache.put(keys[index], scores[index], variance)
+        except mp.TimeoutError:
+            # Workers are still busy with the stale generation
+            self.close()
+            self.open()
+        self.stragglers = scores.count(None)
+        s, self.scores = merge(algorithm, population, scores, self.score_cap)
+        return s
+
+    async def evaluate(self, ai: neural.Network, seed=None) -> tuple[float, float]:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pool.apply_async(_worker_train, ((None, ai, self.iterations, self.score_cap, seed),),
+            callback=lambda res: loop.call_soon_threadsafe(fut.set_result, res[1:]),
+            error_callback=lambda err: loop.call_soon_threadsafe(fut.set_exception, err),
+        )
+        return await fut
+
+def merge(algorithm: neural.algorithm.Genetic, population: list[neural.Network], scores: list[float], score_cap: float=None) -> tuple[float, list[float]]:
+    # Stragglers are the longest survivors so they are given the capped fitness
+    cap = max(filter(None, scores), default=0) if score_cap is None else score_cap
+    scores = [cap if s is None else s for s in scores]
+    collections.deque(map(algorithm.fitness, population, scores), maxlen=0)
     n, s = algorithm.merge(save=False)
-    return s
+    return s, scores
+
+def run_train(game: GameApplication, algorithm: neural.algorithm.Genetic, iterations: int=3, simultaneous: int=None, timeout: int=60, score_cap: float=None) -> neural.algorithm.Genetic:
+    simultaneous = algorithm.population_size if simultaneous is None else simultaneous
+    with Trainer(type(game).__module__, simultaneous, iterations, score_cap) as trainer:
+        return trainer.run(algorithm, timeout)
@@ -0,0 +1,145 @@
+from games.g_dino.main import FLOOR, GameApplication, ObstacleManager, PhysBodySystem
+import game
+import random
+import neural
+import weights
+import collections
+import numpy as np
+
+# Lockstep dino simulation of a whole population, mirroring the rules of main.py
+# The obstacle course does not depend on the player so every member shares one per episode
+
+TIMESTEP = GameApplication.TIMESTEP
+LIMIT = 300 # Simulated seconds per episode
+INPUTS = 2 # Obstacle positions fed to the network, the same as main.py
+
+PLAYER_X = GameApplication.width // 16
+PLAYER_W, PLAYER_H = 50, 100
+PLAYER_MASS = 0.06
+JUMP, FALL = -5000 / PLAYER_MASS, 250 / PLAYER_MASS
+GRAVITY = PhysBodySystem.GRAVITY[1]
+GROUND = FLOOR - PLAYER_H // 2
+
+class Course:
+
+    RANGE = GameApplication.width // 4 + GameApplication.width // 6
+
+    def __init__(self, rng: random.Random):
+        self.random = rng
+        self.children = collections.deque() # [x, y, width, height]
+        self.speed = 1
+        self.dist = 0
+
+    def update(self, dt: float):
+        self.speed += ObstacleManager.RATE * dt
+        if self.children and self.children[0][0] < ObstacleManager._offset:
+            self.children.popleft()
+        if not self.children or (len(self.children) < ObstacleManager.LIMIT and self.children[-1][0] < ObstacleManager._spawn - self.dist):
+            self.add()
+
+        ms = -ObstacleManager.SPEED * self.speed * dt
+        for child in self.children:
+            child[0] += ms
+
+    def add(self):
+        self.dist = self.random.randint(self.RANGE, GameApplication.width)
+        width = self.random.randint(*ObstacleManager.WIDTH)
+        height = ObstacleManager.AREA // width
+        self.children.append([ObstacleManager._spawn, FLOOR - 2 - height // 2, width, height])
+
+    def inputs(self) -> list[float]:
+        data = [1] * INPUTS
+        for i, child in zip(range(INPUTS), self.children):
+            data[i] = neural.maths.constrain(child[i], ObstacleManager._offset, ObstacleManager._spawn)
+        return data
+
+    def hit(self, y: np.ndarray) -> np.ndarray:
+        hit = np.zeros(y.shape, dtype=bool)
+        for x, oy, width, height in self.children:
+            if abs(x - PLAYER_X) < (PLAYER_W + width) / 2:
+                hit |= np.abs(y - oy) < (PLAYER_H + height) / 2
+        return hit
+
+class Simulator:
+
+    def __init__(self, networks: list[neural.Network]):
+        self.network = weights.Batch(networks)
+        self.size = self.network.size
+
+    def episode(self, rng: random.Random, limit: float=LIMIT, dt: float=TIMESTEP) -> np.ndarray:
+        course = Course(rng)
+        y = np.full(self.size, GameApplication.height // 2, dtype=np.float64)
+        velocity = np.zeros(self.size)
+        acceleration = np.zeros(self.size)
+        score = np.zeros(self.size)
+        alive = np.ones(self.size, dtype=bool)
+        floor = np.zeros(self.size, dtype=bool)
+        touch = np.zeros(self.size, dtype=bool)
+        jump = np.zeros(self.size, dtype=bool)
+        fall = np.zeros(self.size, dtype=bool)
+
+        for _ in range(int(limit / dt)):
+            score[alive] += dt * 20
+            course.update(dt)
+
+            # PlayerController
+            alive &= ~(touch & (score - dt * 20 >= 1))
+            if not alive.any():
+                break
+            acceleration[jump & floor] += JUMP
+            acceleration[fall & ~floor] += FALL
+            y[floor] = GROUND
+            velocity[floor] = 0
+
+            # PlayerControllerAI
+            choice = self.network.feed(*course.inputs()).argmax(axis=1)
+            fall, jump = choice == 0, choice == 1
+
+            # PhysBodySystem & Collider
+            adt = acceleration * dt
+            y += velocity * dt + 0.5 * adt * dt
+            velocity += adt
+            acceleration[:] = GRAVITY
+            floor = y + PLAYER_H // 2 >= FLOOR
+            touch = course.hit(y)
+        return score
+
+    def run(self, iterations: int, limit: float=LIMIT, seed=None) -> tuple[np.ndarray, np.ndarray]:
+        scores = np.stack([self.episode(game.episode_rng(seed, episode), limit) for episode in range(iterations)])
+        return scores.mean(axis=0), scores.var(axis=0)
+
+class Trainer:
+    # Same interface as game.Trainer, evaluating the population in this process
+    TOLERANCE = 1e-9
+
+    def __init__(self, iterations: int=3, limit: float=LIMIT):
+        self.iterations = iterations
+        self.limit = limit
+        self.stragglers = 0
+        self.scores: list[float] = []
+        self.seed = None
+        self.cache = game.FitnessCache()
+        self._checked = False
+
+    def open(self):
+        pass
+    def close(self):
+        pass
+
+    def run(self, algorithm: neural.algorithm.Genetic, timeout: int=None) -> float:
+        population = list(algorithm.population())
+        if not self._checked:
+            # Batch assumes logistic neurons, refuse to train a network it does not reproduce
+            if (error := weights.parity(population[0], INPUTS)) > self.TOLERANCE:
+                raise ValueError(f"Batch Feed Differs from Network Feed: {error}")
+            self._checked = True
+        keys, self.scores = self.cache.lookup(population, self.seed)
+        jobs = [i for i, score in enumerate(self.scores) if score is None]
+        if jobs:
+            fitness, variance = Simulator([population[i] for i in jobs]).run(self.iterations, self.limit, self.seed)
+            for index, f, v in zip(jobs, fitness.tolist(), variance.tolist()):
+                self.scores[index] = f
+                self.cache.put(keys[index], f, v)
+        collections.deque(map(algorithm.fitness, population, self.scores), maxlen=0)
+        n, s = algorithm.merge(save=False)
+        return s
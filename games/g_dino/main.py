@@ -2,6 +2,7 @@ from game import engine, GameApplication
 import enum
 import neural
 import random
+import statistics
 from collections import deque
 from interface import Interface
 
@@ -69,6 +70,10 @@ class StateManager(engine.component.Script):
             self.state = self.GameState.HIT
             engine.app().program.database(self.score)
 
+    def capped(self) -> bool:
+        program = engine.app().program
+        return program.AIState is program.AIState.TRAIN and program.score_cap is not None and self.score >= program.score_cap
+
     def reset(self):
         self.obstacle.reset()
         self.score = 0
@@ -108,6 +113,8 @@ class ObstacleManager(engine.component.Script):
         self.vel = engine.Vector(-self.SPEED, 0)
         self.speed = 1
         self.dist = 0
+        self.random = random.Random()
+        self._episode = 0
 
         self._colour_array = [(1,0,0), (1,.75,0), (0,1,0), (0,.5,.5), (0,0,1), (.5,0,.5)]
         self._colour_count = 0
@@ -127,6 +134,8 @@ class ObstacleManager(engine.component.Script):
         self.vel = engine.Vector(-self.SPEED, 0)
         self.speed = 1
         self.dist = 0
+        self.random = engine.app().program.rng(self._episode)
+        self._episode += 1
         for i in range(len(self.children)):
             self.remove()
         self._colour_count = 0
@@ -150,8 +159,8 @@ class ObstacleManager(engine.component.Script):
         engine.app().world.destroy(self.children.popleft().entity)
 
     def add(self):
-        self.dist = random.randint(self.__range, GameApplication.width)
-        width = random.randint(*self.WIDTH)
+        self.dist = self.random.randint(self.__range, GameApplication.width)
+        width = self.random.randint(*self.WIDTH)
         dim = engine.Vector(width, self.AREA // width)
         obstacle = Obstacle(*dim)
         engine.instantiate(
@@ -213,7 +222,7 @@ class PlayerController(engine.component.Script):
         else:
             self.floor = False
 
-        if self.layers["Obstacle"] in collisions:
+        if self.layers["Obstacle"] in collisions or self.manager.capped():
             self.manager.collide()
             try:
                 self.Get(PlayerControllerAI).fail()
@@ -266,13 +275,14 @@ class PlayerControllerAI(engine.component.Script):
         self.network = Application.AI
         # Output: Fall, Jump
 
-        self.iteration, self.score = 0, 0
+        self.iteration, self.scores = 0, []
 
     def initialize(self):
         super().initialize()
         self.controller = self.Get(PlayerController)
         self.network = engine.app().program.AI
-        engine.app().window.title(f"Dinosaur - {self.iteration}")
+        if not engine.app().program.headless:
+            engine.app().window.title(f"Dinosaur - {self.iteration}")
 
     def terminate(self):
         app = engine.app()
@@ -281,7 +291,8 @@ class PlayerControllerAI(engine.component.Script):
         if self.iteration < engine.app().program.iterations:
             engine.app().program.fitness = None
         else:
-            engine.app().program.fitness = self.score / self.iteration
+            engine.app().program.fitness = statistics.fmean(self.scores)
+            engine.app().program.variance = statistics.pvariance(self.scores)
 
     def update(self):
         data = [1] * 2
@@ -301,8 +312,9 @@ class PlayerControllerAI(engine.component.Script):
             if app.program.AIState is not app.program.AIState.TRAIN:
                 return app.event(engine.event.KeyPress(engine.input.Key.R))
             self.iteration += 1
-            self.score += self.manager.score
-            app.window.title(f"Dinosaur - {self.iteration}")
+            self.scores.append(self.manager.score)
+            if not app.program.headless:
+                app.window.title(f"Dinosaur - {self.iteration}")
             if self.iteration >= app.program.iterations:
                 return app.event(engine.event.KeyPress(engine.input.Key.ESCAPE))
             app.event(engine.event.KeyPress(engine.input.Key.R))
@@ -321,10 +333,11 @@ class Application(GameApplication):
         super().initialize(app)
         engine.instantiate(engine.component.Event(self.close_event, "WINDOW"), id=False)
 
-        app.window._master.title(f"Dinosaur")
-        app.world.system(engine.ecs.systems.Render, True)
         app.world.add_system(PhysBodySystem(), "PHYSICS")
-        app.world.add_system(engine.ecs.systems.FPS(), "POST")
+        if not self.headless:
+            app.window._master.title(f"Dinosaur")
+            app.world.system(engine.ecs.systems.Render, True)
+            app.world.add_system(engine.ecs.systems.FPS(), "POST")
 
         setting_collision = app.setting.collision()
         setting_collision.matrix.make(
@@ -1,8 +1,7 @@
 from game import Game, engine
-import random
 
 import neural
-import pickle
+import weights
 from path import PATH
 
 class Paddle(engine.component.Script):
@@ -95,13 +94,12 @@ class PaddleAI(engine.component.Script):
 
     def _load_net(self):
         try:
-            with open(PATH+f"games/pong/{engine.app().program.game.id}.net", "rb") as file:
-                self.network = pickle.load(file)
-        except FileNotFoundError:
+            self.network = weights.load(PATH+f"games/pong/{engine.app().program.game.id}.net")
+        except (FileNotFoundError, ValueError):
             pass
     def _save_net(self):
         with open(PATH+f"games/pong/{engine.app().program.game.id}.net", "wb") as file:
-            pickle.dump(self.network, file)
+            file.write(weights.dumps(self.network))
 
     def event(self, event: engine.event.KeyPress):
         if event.dispatch(engine.event.KeyPress) and event.key is engine.input.Key.COLON:
@@ -133,12 +131,13 @@ class Ball(engine.component.Script):
         self.transform = self.Get(engine.component.Transform)
         self.collider = self.Get(engine.component.Collider)
         self.prev = None
+        self.random = engine.app().program.rng()
         self.reset()
 
     def reset(self, side: int=None):
         self.transform.position = engine.Vector(Game.width, Game.height) // 2
-        side = side if isinstance(side, int) else random.randint(0, 1)
-        theta = random.randint(7, 30) * (random.randint(0, 1) * 2 - 1)
+        side = side if isinstance(side, int) else self.random.randint(0, 1)
+        theta = self.random.randint(7, 30) * (self.random.randint(0, 1) * 2 - 1)
         # theta = 0
         self.velocity = engine.Vector(side * 2 - 1, 0).rotate(theta) * self.SPEED
         self.speed = 0
@@ -1,5 +1,4 @@
 from game import Game, engine
-import random
 
 SCALE = 20
 
@@ -56,11 +55,12 @@ class Food(engine.ecs.Component):
 
     def initialize(self):
         self.transform = self.Get(engine.component.Transform)
+        self.random = engine.app().program.rng()
         self.move()
         return True
 
     def move(self):
-        self.transform.position = engine.Vector(random.randrange(1, Game.width // SCALE), random.randrange(1, Game.height // SCALE)) * SCALE
+        self.transform.position = engine.Vector(self.random.randrange(1, Game.width // SCALE), self.random.randrange(1, Game.height // SCALE)) * SCALE
 
 class Body(engine.ecs.Component):
 
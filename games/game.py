@@ -1 +0,0 @@
-pass
@@ -0,0 +1,70 @@
+import bisect
+from collections import namedtuple, defaultdict
+
+__all__ = ["Entry", "Board", "Leaderboard"]
+
+Entry = namedtuple("Entry", ("user", "game", "ai", "value"))
+
+class Board:
+    # Top entries in descending score order, newest first on ties
+
+    def __init__(self, size: int):
+        self.size = size
+        self._keys: list[tuple[int, int]] = []
+        self._entries: list[Entry] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, id: int, entry: Entry):
+        key = (-entry.value, -id)
+        if len(self._keys) >= self.size and key >= self._keys[-1]:
+            return
+        index = bisect.bisect(self._keys, key)
+        self._keys.insert(index, key)
+        self._entries.insert(index, entry)
+        if len(self._keys) > self.size:
+            self._keys.pop()
+            self._entries.pop()
+
+    def page(self, page: int, size: int) -> list[Entry]:
+        return self._entries[page * size:(page + 1) * size]
+
+class Leaderboard:
+    # Materialized top N scores overall, per game, per AI and per user
+
+    def __init__(self, size: int=1000):
+        self.size = size
+        self.users: dict[int, str] = {}
+        self.games: dict[int, str] = {}
+        self.ais: dict[int, tuple[int, str]] = {}
+        self.boards: dict[str, dict[int, Board]] = {t: defaultdict(self._board) for t in ("user", "game", "ai")}
+        self.all = Board(size)
+        self._next = 0
+
+    def _board(self) -> Board:
+        return Board(self.size)
+
+    def add(self, id: int, user: int, ai: int, value: int):
+        # Scores not yet written to the database are ordered after every known id
+        if id is None:
+            id = self._next
+        self._next = max(self._next, id + 1)
+        game, ai_name = self.ais.get(ai, (None, str(None)))
+        entry = Entry(self.users.get(user, str(None)), self.games.get(game, str(None)), ai_name, value)
+        self.all.add(id, entry)
+        self.boards["user"][user].add(id, entry)
+        self.boards["game"][game].add(id, entry)
+        self.boards["ai"][ai].add(id, entry)
+
+    def board(self, type: str="all", data=None) -> Board:
+        if type in self.boards:
+            return self.boards[type][data]
+        return self.all
+
+    def page(self, type: str="all", data=None, page: int=0, size: int=50) -> list[Entry]:
+        # None when the page lies beyond the materialized top N
+        board = self.board(type, data)
+        if (page + 1) * size > self.size and len(board) >= self.size:
+            return None
+        return board.page(page, size)
@@ -1,18 +1,27 @@
 import os
-import caching
+import sys
+import blob
+import catalogue
+import weights
 import importlib
-import pickle
+import py_compile
+import checkpoint
 from path import PATH
+from collections import OrderedDict
 
-FILE = "game.py"
 AIFILE = "ai.net"
 DIR = "games/"
 DIRP = PATH + DIR
+CACHE = "cache/"
+CACHEP = DIRP + CACHE
 
-def new(filename: str=FILE):
-    with open(DIRP+filename, "w") as file:
-        file.write("pass\n")
-    return importlib.import_module(DIR.replace("/", ".")+filename.split(".", 1)[0])
+def package(directory: str) -> str:
+    # The module path is relative to PATH, which is on sys.path
+    os.makedirs(directory, exist_ok=True)
+    if not os.path.exists(init := f"{directory}__init__.py"):
+        with open(init, "w") as file:
+            file.write("")
+    return os.path.relpath(directory, PATH).replace(os.sep, ".")
 
 def validate(module) -> bool:
     if hasattr(module, "main"):
@@ -20,50 +29,65 @@ def validate(module) -> bool:
     return False
 
 class GameSet:
-    def __init__(self):
+    # Every game is its own module named by content hash, so child processes can import it
+    SIZE = 4
+
+    def __init__(self, size: int=SIZE):
         self.names = {}
         self.active: str = None
-        self._module = new()
+        self.size = size
+        self._package = package(CACHEP)
+        self._modules: OrderedDict[str, object] = OrderedDict()
+        self._module = None
         self.ai = None
-        self.reload()
 
-    def reload(self) -> bool:
-        module = importlib.reload(self._module)
-        self._valid = validate(module)
-        if self._valid:
-            self._module = module
-        else:
-            self._valid = validate(self._module)
-        return self._valid
+    def load(self, data: bytes) -> bool:
+        # Keeps the previous game when the new one fails to import
+        hash = blob.digest(data)
+        if (module := self._modules.get(hash)) is None:
+            module = self._import(hash, data)
+            if module is None or not validate(module):
+                return False
+            self._modules[hash] = module
+        self._modules.move_to_end(hash)
+        while len(self._modules) > self.size:
+            _, old = self._modules.popitem(last=False)
+            sys.modules.pop(old.__name__, None)
+        self._module = module
+        return True
+
+    def _import(self, hash: str, data: bytes):
+        name = f"game_{hash}"
+        filename = f"{CACHEP}{name}.py"
+        try:
+            if not os.path.exists(filename):
+                checkpoint.write(filename, data)
+                py_compile.compile(filename, doraise=True)
+                importlib.invalidate_caches()
+            return importlib.import_module(f"{self._package}.{name}")
+        except Exception as e:
+            print("Game Failed To Load:", type(e).__name__, e)
+            return None
 
     def get(self):
         return self._module
 
     def valid(self) -> bool:
-        return self._valid
+        return self._module is not None
 
     def set_ai(self, data: bytes):
-        self.ai = pickle.loads(data)
-
-def read_game(filename: str) -> bytes:
-    with open(f"{DIRP}g_{filename}/main.py", "rb") as file:
-        return file.read()
+        self.ai = weights.loads(data)
 
-def write_game(data: bytes):
-    with open(f"{DIRP}{FILE}", "wb") as file:
-        file.write(data)
+def game_file(filename: str) -> str:
+    return f"{DIRP}g_{filename}/main.py"
 
-def read_ai(game: str, filename: str) -> bytes:
-    with open(f"{DIRP}g_{game}/net/{filename}", "rb") as file:
-        return file.read()
+def ai_file(game: str, filename: str) -> str:
+    return f"{DIRP}g_{game}/net/{filename}"
 
-@caching.cache(1)
 def find_file(name: str) -> str:
-    filename = "g_{}".format(name)
-    if filename in os.listdir(DIRP) and "main.py" in os.listdir(DIRP+filename):
-        return filename
+    if catalogue.catalogue.game(name) is not None:
+        return "g_{}".format(name)
     return False
 
-@caching.cache(1)
 def list_avalible() -> list[str]:
-    return [filename[2:] for filename in os.listdir(DIRP) if filename.startswith("g_")]
+    return catalogue.catalogue.names()
@@ -0,0 +1,211 @@
+import json
+import time
+import node
+import random
+import asyncio
+import metrics
+from interface import Interface
+
+# Simulated clients against a running game server, results are written as JSON
+
+class LoadClient(node.Client):
+    def __init__(self, addr: str, port: int, password: str, registry: metrics.Registry):
+        super().__init__(addr, port)
+        self.password = password
+        self.registry = registry
+        self._tag = 0
+
+    async def open(self) -> bool:
+        start = time.perf_counter()
+        if not (await super().open()):
+            self.registry.record("client", "CONNECT", time.perf_counter() - start, error=True)
+            return False
+        self.send(self.password, "PASSWORD")
+        response = await self.recv("PASSWORD")
+        ok = bool(response and response[0].data)
+        self.registry.record("client", "CONNECT", time.perf_counter() - start, error=not ok)
+        return ok
+
+    async def request(self, data, channel: str):
+        self._tag += 1
+        tag = node.Tag(self._tag)
+        start = time.perf_counter()
+        self.send(data, channel, tag)
+        response = await self.recv(channel, tag)
+        data_in = response[0].data if response else None
+        self.registry.record("client", channel, time.perf_counter() - start, metrics.size(data_in), error=not response)
+        self.registry.sent("client", channel, metrics.size(data))
+        return data_in
+
+async def session(client: LoadClient, duration: float, interval: float, games: list[int]):
+    # Mostly idle, with a listing or a download every interval seconds on average
+    end = time.monotonic() + duration
+    while client and time.monotonic() < end:
+        await asyncio.sleep(random.expovariate(1 / interval) if interval else 0)
+        if not games or random.random() < 0.5:
+            await client.request(b"", "GLIST")
+        else:
+            await client.request((random.choice(games), None), "GAME")
+
+class StallProxy:
+    # Relays one connection to the server and, once stalled, stops reading the server's side
+    # so the server sees a client that never reads, whatever the node framing is
+
+    def __init__(self, addr: str, port: int):
+        self.addr = addr
+        self.port = port
+        self._flowing = asyncio.Event()
+        self._flowing.set()
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._accept, "127.0.0.1", 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        upstream_reader, upstream_writer = await asyncio.open_connection(self.addr, self.port)
+        self._tasks += [
+            asyncio.ensure_future(self._pipe(reader, upstream_writer)),
+            asyncio.ensure_future(self._pipe(upstream_reader, writer, self._flowing)),
+        ]
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, gate: asyncio.Event=None):
+        try:
+            while True:
+                if gate is not None:
+                    await gate.wait()
+                if not (data := await reader.read(1 << 16)):
+                    break
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def stall(self):
+        self._flowing.clear()
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._server.close()
+        await self._server.wait_closed()
+
+def rss(pid: int) -> int:
+    # Resident bytes of the server process, None where /proc is unavailable
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+async def stalled(args, games: list[int]) -> list[tuple[LoadClient, StallProxy]]:
+    # Each one asks for downloads and then never reads the replies
+    registry = metrics.Registry()
+    opened = []
+    for _ in range(args.stall):
+        proxy = StallProxy(args.addr, args.port)
+        client = LoadClient("127.0.0.1", await proxy.start(), args.password, registry)
+        if not (await client.open()):
+            await proxy.close()
+            continue
+        proxy.stall()
+        for _ in range(args.stall_requests):
+            client._tag += 1
+            client.send((random.choice(games), None), "GAME", node.Tag(client._tag))
+        opened.append((client, proxy))
+    return opened
+
+async def sample_rss(pid: int, samples: list[int]):
+    while True:
+        if (value := rss(pid)) is not None:
+            samples.append(value)
+        await asyncio.sleep(0.5)
+
+async def load(args) -> dict:
+    registry = metrics.Registry()
+    clients = [LoadClient(args.addr, args.port, args.password, registry) for _ in range(args.clients)]
+
+    # Connections are opened in waves so the accept backlog is not the thing being measured
+    start = time.perf_counter()
+    opened = []
+    for index in range(0, len(clients), args.ramp):
+        wave = clients[index:index + args.ramp]
+        for client, ok in zip(wave, await asyncio.gather(*(c.open() for c in wave))):
+            if ok:
+                opened.append(client)
+    connect = time.perf_counter() - start
+
+    games = [gid for gid, _ in (await opened[0].request(b"", "GLIST") or [])] if opened else []
+    samples = []
+    sampler = asyncio.ensure_future(sample_rss(args.server_pid, samples)) if args.server_pid else None
+    stalls = await stalled(args, games) if args.stall and games else []
+    start = time.perf_counter()
+    await asyncio.gather(*(session(c, args.duration, args.interval, games) for c in opened))
+    elapsed = time.perf_counter() - start
+    if sampler is not None:
+        sampler.cancel()
+    await asyncio.gather(*(c.close() for c in opened))
+    for client, proxy in stalls:
+        await client.close()
+        await proxy.close()
+
+    return {
+        "clients": args.clients,
+        "connected": len(opened),
+        "connect_seconds": connect,
+        "seconds": elapsed,
+        "requests_per_second": sum(m.count for (kind, name), m in registry.metrics.items() if name != "CONNECT") / elapsed,
+        "stalled": len(stalls),
+        "server_rss_first": samples[0] if samples else None,
+        "server_rss_peak": max(samples, default=None),
+        "metrics": registry.snapshot(),
+        "time": time.time(),
+    }
+
+def run(args) -> dict:
+    async def main():
+        try:
+            return await load(args)
+        finally:
+            Interface.stop()
+    future = Interface.schedule(main())
+    Interface.main()
+    return future.result()
+
+if __name__ == "__main__":
+    import argparse
+    import website
+
+    parser = argparse.ArgumentParser(description="Game Server Load Test")
+    parser.add_argument("-a", "--addr", dest="addr", type=str, default="127.0.0.1",
+        help="Server IPv4 Address")
+    parser.add_argument("-p", "--port", dest="port", type=int, default=609,
+        help="Server Port Number")
+    parser.add_argument("-c", "--clients", dest="clients", type=int, default=2000,
+        help="Simulated Clients")
+    parser.add_argument("--ramp", dest="ramp", type=int, default=200,
+        help="Clients Connected per Wave")
+    parser.add_argument("-d", "--duration", dest="duration", type=float, default=30,
+        help="Seconds each Client Stays Connected")
+    parser.add_argument("-i", "--interval", dest="interval", type=float, default=5,
+        help="Mean Seconds between Requests per Client")
+    parser.add_argument("--stall", dest="stall", type=int, default=0,
+        help="Clients that Request Downloads and Never Read")
+    parser.add_argument("--stall-requests", dest="stall_requests", type=int, default=64,
+        help="Downloads Requested by each Stalled Client")
+    parser.add_argument("--server-pid", dest="server_pid", type=int,
+        help="Sample the Server's Resident Memory from /proc")
+    parser.add_argument("-o", "--out", dest="out", type=str,
+        help="JSON Output File")
+    args = parser.parse_args()
+    args.password = website.config("server.cfg", write=False)["server"]["password"]
+    report = run(args)
+    print(json.dumps({k: v for k, v in report.items() if k != "metrics"}))
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump(report, file, indent=2)
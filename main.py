@@ -26,12 +26,14 @@ if __name__ == "__main__":
             help="Regenerate the Database")
         parser_server.add_argument("--headless", dest="no_client", action="store_true",
             help="Run without Client")
+        parser_server.add_argument("--workers", dest="workers", type=int, default=1,
+            help="Server Processes Sharing the Ports")
         return parser_main
 
     def main():
         args = parser().parse_args()
         if args.server:
-            Interface.schedule(server.main(args.repopulate))
+            Interface.schedule(server.main(args.repopulate, args.workers))
             if args.no_client:
                 while Interface.active():
                     time.sleep(1)
@@ -0,0 +1,133 @@
+import time
+import bisect
+import logging
+import functools
+from collections import defaultdict
+
+__all__ = ["BOUNDS", "Histogram", "Metric", "Registry", "registry", "size", "timed", "Sampler"]
+
+# Latency bucket upper bounds in seconds, 100us doubling up to about 13s
+BOUNDS = tuple(0.0001 * 2 ** i for i in range(18))
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.sum = 0.0
+
+    def add(self, value: float):
+        self.counts[bisect.bisect_left(BOUNDS, value)] += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation
+        target = q * sum(self.counts)
+        total = 0
+        for bound, count in zip(BOUNDS + (float("inf"),), self.counts):
+            total += count
+            if count and total >= target:
+                return bound
+        return 0.0
+
+class Metric:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = Histogram()
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count, "errors": self.errors,
+            "bytes_in": self.bytes_in, "bytes_out": self.bytes_out,
+            "latency_sum": self.latency.sum,
+            "p50": self.latency.quantile(0.5), "p99": self.latency.quantile(0.99),
+        }
+
+class Registry:
+    # Plain counters updated inline, only the snapshot and text export do any real work
+
+    def __init__(self):
+        self.metrics: dict[tuple[str, str], Metric] = defaultdict(Metric)
+
+    def record(self, kind: str, name: str, seconds: float, bytes_in: int=0, error: bool=False):
+        metric = self.metrics[(kind, name)]
+        metric.count += 1
+        metric.errors += error
+        metric.bytes_in += bytes_in
+        metric.latency.add(seconds)
+
+    def sent(self, kind: str, name: str, bytes_out: int):
+        self.metrics[(kind, name)].bytes_out += bytes_out
+
+    def get(self, kind: str, name: str) -> Metric:
+        return self.metrics.get((kind, name))
+
+    def snapshot(self) -> dict[str, dict[str, dict]]:
+        data = defaultdict(dict)
+        for (kind, name), metric in sorted(self.metrics.items()):
+            data[kind][name] = metric.snapshot()
+        return dict(data)
+
+    def text(self) -> str:
+        # Prometheus text exposition format
+        lines = []
+        for (kind, name), metric in sorted(self.metrics.items()):
+            label = f'kind="{kind}",name="{name}"'
+            lines.append(f"requests_total{{{label}}} {metric.count}")
+            lines.append(f"errors_total{{{label}}} {metric.errors}")
+            lines.append(f"bytes_in_total{{{label}}} {metric.bytes_in}")
+            lines.append(f"bytes_out_total{{{label}}} {metric.bytes_out}")
+            total = 0
+            for bound, count in zip(BOUNDS, metric.latency.counts):
+                total += count
+                lines.append(f'latency_seconds_bucket{{{label},le="{bound:g}"}} {total}')
+            lines.append(f'latency_seconds_bucket{{{label},le="+Inf"}} {metric.count}')
+            lines.append(f"latency_seconds_sum{{{label}}} {metric.latency.sum}")
+            lines.append(f"latency_seconds_count{{{label}}} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+def size(obj) -> int:
+    # Approximate payload size, the framing added by node is not counted
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return len(obj)
+    if isinstance(obj, str):
+        return len(obj.encode())
+    if isinstance(obj, (tuple, list)):
+        return sum(map(size, obj))
+    if obj is None:
+        return 0
+    return 8
+
+def timed(kind: str, name: str):
+    # Wraps an async handler taking (self, data: node.Data)
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, data, *args, **kwargs):
+            start = time.perf_counter()
+            error = True
+            try:
+                result = await func(self, data, *args, **kwargs)
+                error = False
+                return result
+            finally:
+                registry.record(kind, name, time.perf_counter() - start, size(data.data), error)
+        return wrapper
+    return decorator
+
+class Sampler(logging.Filter):
+    # Passes one in every rate records below WARNING for each message, warnings and errors always pass
+
+    def __init__(self, rate: int=1):
+        super().__init__()
+        self.rate = max(1, rate)
+        self._seen: dict[str, int] = defaultdict(int)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate == 1:
+            return True
+        seen = self._seen[record.msg]
+        self._seen[record.msg] = seen + 1
+        return seen % self.rate == 0
@@ -0,0 +1,68 @@
+import socket
+import asyncio
+import logging
+
+__all__ = ["free_ports", "Relay"]
+
+log = logging.getLogger("relay")
+
+def free_ports(count: int) -> list[int]:
+    # All held open together so the same port is not handed out twice
+    sockets = [socket.socket() for _ in range(count)]
+    try:
+        for sock in sockets:
+            sock.bind(("127.0.0.1", 0))
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+class Relay:
+    # Listens on a public port shared by every worker through SO_REUSEPORT, the kernel picks a worker
+    # for each connection and the relay pipes it to that worker's own server on a loopback port
+    BUFFER = 1 << 16
+
+    def __init__(self, port: int, target: int):
+        self.port = port
+        self.target = target
+        self._server: asyncio.Server = None
+        self._tasks: set[asyncio.Task] = set()
+        self._writers: set[asyncio.StreamWriter] = set()
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._accept, port=self.port, reuse_port=True)
+        return self
+
+    async def __aexit__(self, *args):
+        # Closing both ends lets every pipe finish on its own rather than being cancelled mid write
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", self.target)
+        except OSError:
+            log.warning("Worker Unreachable: %s", self.target)
+            return writer.close()
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        self._writers.update((writer, upstream_writer))
+        try:
+            # Each side waits for the other to drain, so a slow reader holds back the worker's transport
+            await asyncio.gather(self._pipe(reader, upstream_writer), self._pipe(upstream_reader, writer))
+        finally:
+            self._tasks.discard(task)
+            self._writers.difference_update((writer, upstream_writer))
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while data := await reader.read(self.BUFFER):
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
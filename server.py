@@ -1,89 +1,228 @@
 import db
+import time
+import socket
+import broker
+import relay
+import auth
+import blob
+import catalogue
 import node
 import loader
 import asyncio
+import logging
+import metrics
 import website
+import webcache
+import multiprocessing as mp
+import multiprocessing.connection
+from path import PATH
 from interface import Interface
 
+log = logging.getLogger("server")
+
 class SClient(node.SClient):
+    HANDSHAKE_TIMEOUT = 10
+    SEND_LIMIT = 1 << 20 # Bytes buffered in the transport before handlers wait for it to drain
+    DRAIN_POLL = 0.05
+    CHUNK = 64 << 10
 
     async def open(self):
         await super().open()
         self.db: db.Database = self.server.database
-        await self.send(((await self.recv("PASSWORD"))[0].data == self.server.cfg["password"]), "PASSWORD")
-        print("Connection:", self._node)
+        self._admitted = False
+        self._closed = False
+        self._last: asyncio.Future = None
+        self._writer, self._transport = self._stream()
+        if self._transport is not None:
+            self._transport.set_write_buffer_limits(high=self.SEND_LIMIT)
+        elif not self.server.unbuffered:
+            # Once per server, without it SEND_LIMIT does nothing and a load test would say otherwise
+            self.server.unbuffered = True
+            log.warning("Write Buffer Unavailable: SEND_LIMIT Inactive, Only Completed Sends are Awaited")
+        try:
+            password = (await asyncio.wait_for(self.recv("PASSWORD"), self.HANDSHAKE_TIMEOUT))[0].data
+        except (asyncio.TimeoutError, IndexError):
+            log.info("Handshake Failed: %s", self._node)
+            return await self.close()
+        # Past the soft limit a client waits here for a free slot instead of being refused
+        if self.server.admission.locked():
+            log.info("Admission Queued: %s", self._node)
+        await self.server.admission.acquire()
+        self._admitted = True
+        # A client that left while queued already ran close, so the slot is given back here
+        if self._closed or not self:
+            log.info("Left While Queued: %s", self._node)
+            return await self.close()
+        await self.send(password == self.server.cfg["password"], "PASSWORD")
+        log.info("Connection: %s", self._node)
+
+    async def close(self):
+        self._closed = True
+        if getattr(self, "_admitted", False):
+            self._admitted = False
+            self.server.admission.release()
+        return await super().close()
+
+    def _stream(self) -> tuple[asyncio.StreamWriter, asyncio.WriteTransport]:
+        # node keeps its stream private, so it is found by type rather than by name
+        for value in vars(self).values():
+            if isinstance(value, asyncio.StreamWriter):
+                return value, value.transport
+            if isinstance(value, asyncio.WriteTransport):
+                return None, value
+        return None, None
+
+    def send(self, data, channel: str, *tags: node.Tag):
+        metrics.registry.sent("dispatch", channel, metrics.size(data))
+        future = self._last = asyncio.ensure_future(super().send(data, channel, *tags))
+        return future
 
+    async def drain(self):
+        # Sends already made are written into the transport first, then its buffer has to fall below SEND_LIMIT
+        if self._last is not None and not self._last.done():
+            await asyncio.wait((self._last,))
+        try:
+            if self._writer is not None:
+                await self._writer.drain()
+            elif self._transport is not None:
+                while self._transport.get_write_buffer_size() > self.SEND_LIMIT and not self._transport.is_closing():
+                    await asyncio.sleep(self.DRAIN_POLL)
+        except ConnectionError:
+            pass
+
+    async def send_blob(self, data: blob.Blob, known: str, channel: str, *tags: node.Tag):
+        # True tells the client its copy is current
+        if data.hash == known:
+            return self.send(True, channel, *tags)
+        # A slow reader holds up its own handlers rather than growing the send queue
+        await self.drain()
+        if len(data.data) <= self.CHUNK:
+            return self.send((data.hash, data.data), channel, *tags)
+        # Large files go as a (hash, count) header followed by count chunks on the same tags
+        chunks = range(0, len(data.data), self.CHUNK)
+        self.send((data.hash, len(chunks)), channel, *tags)
+        for start in chunks:
+            await self.drain()
+            self.send(data.data[start:start + self.CHUNK], channel, *tags)
+
+    @metrics.timed("dispatch", "GAME")
     async def dsptch_game(self, data: node.Data):
-        print("Game Request:", data.data)
-        if game := await self.db.game(data.data):
-            print("Game File:", data.data, game[0])
-            return self.send(loader.read_game(game[1]), "GAME", node.Tag(data.data))
-        print("Game Not Found:", data.data)
-        return self.send(False, "GAME", node.Tag(data.data))
+        gid, known = data.data
+        log.debug("Game Request: %s", gid)
+        if game := await self.db.game(gid):
+            try:
+                return await self.send_blob(await self.server.blobs.aget(loader.game_file(game[1])), known, "GAME", *map(node.Tag, data.tag))
+            except FileNotFoundError:
+                pass
+        log.warning("Game Not Found: %s", gid)
+        return self.send(False, "GAME", *map(node.Tag, data.tag))
 
+    # Responses echo the request tag so the client can match them while others are in flight
+    @metrics.timed("dispatch", "GLIST")
     async def dsptch_glist(self, data: node.Data):
-        print("Request Game List")
-        glist = await self.db.game_list()
-        self.send(len(glist), "GLIST")
-        for element in glist:
-            self.send(tuple(element), "GLIST")
+        log.debug("Request Game List")
+        self.send([tuple(element) for element in await self.db.game_list()], "GLIST", *map(node.Tag, data.tag))
 
+    @metrics.timed("dispatch", "AILIST")
     async def dsptch_ailist(self, data: node.Data):
-        print("Request AI List", data.data)
-        ailist = await self.db.ai_list(data.data)
-        tag = node.Tag(data.data)
-        self.send(len(ailist), "AILIST", tag)
-        for element in ailist:
-            self.send(tuple(element), "AILIST", tag)
+        log.debug("Request AI List: %s", data.data)
+        self.send([tuple(element) for element in await self.db.ai_list(data.data)], "AILIST", *map(node.Tag, data.tag))
 
+    @metrics.timed("dispatch", "AI")
     async def dsptch_ai(self, data: node.Data):
-        print("AI Request:", data.data)
-        if ai := await self.db.ai(data.data):
-            _, filename = await self.db.ai_game(data.data)
-            ai_data = loader.read_ai(filename, ai[1])
-            return self.send(ai_data, "AI", node.Tag(data.data))
-        return self.send(False, "AI", node.Tag(data.data))
-
-    async def dsptch_database(node: 'node.DataInterface', data: node.Data):
-        print("Database Request", data)
+        aid, known = data.data
+        log.debug("AI Request: %s", aid)
+        if ai := await self.db.ai(aid):
+            _, filename = await self.db.ai_game(aid)
+            try:
+                return await self.send_blob(await self.server.blobs.aget(loader.ai_file(filename, ai[1])), known, "AI", *map(node.Tag, data.tag))
+            except FileNotFoundError:
+                pass
+        log.warning("AI Not Found: %s", aid)
+        return self.send(False, "AI", *map(node.Tag, data.tag))
+
+    @metrics.timed("dispatch", "DATABASE")
+    async def dsptch_database(self, data: node.Data):
+        log.debug("Database Request: %s", data.data)
         uid = data.data
         gid, aid = map(int, data.tag)
-        val = (await node.recv("DATABASE_VALUE"))[0].data
-        await node.db.create_score(uid, aid, val)
+        val = (await self.recv("DATABASE_VALUE"))[0].data
+        await self.db.create_score(uid, aid, val)
 
-    async def dsptch_login(node: 'node.DataInterface', data: node.Data):
-        print("Login Request", data)
+    @metrics.timed("dispatch", "LOGIN")
+    async def dsptch_login(self, data: node.Data):
+        log.debug("Login Request: %s", data.data)
         uname = data.data
-        pwd = (await node.recv("LOGIN_PASSWORD"))[0].data
-        try:
-            uid = await node.db.login(uname, pwd)
-        except TypeError:
-            uid = 1
-        node.send(uid, "LOGIN")
+        pwd = (await self.recv("LOGIN_PASSWORD"))[0].data
+        if (uid := await self.db.login(uname, pwd)) is None:
+            log.info("Login Failed: %s", uname)
+            return self.send((1, None), "LOGIN", *map(node.Tag, data.tag))
+        self.send((uid, self.server.sessions.create(uid)), "LOGIN", *map(node.Tag, data.tag))
+
+    @metrics.timed("dispatch", "SESSION")
+    async def dsptch_session(self, data: node.Data):
+        # Reconnects present their token and never touch the database
+        self.send(self.server.sessions.verify(data.data), "SESSION", *map(node.Tag, data.tag))
 
 class CSStyle(website.Request):
+    MAX_AGE = 604800
+
     async def handle(self):
+        filename = "/".join(self.request[1:])
+        if (entry := webcache.cache.get(f"style/{filename}")) is None:
+            files = []
+            try:
+                # Cold misses read and flatten the files in the executor, never on the loop
+                data = b"".join(await asyncio.get_running_loop().run_in_executor(None, self.load_style, filename, files))
+            except (FileNotFoundError, IsADirectoryError, ValueError):
+                log.info("Style Not Found: %s", filename)
+                return self.missing()
+            entry = webcache.cache.put(f"style/{filename}", data, files)
+        webcache.respond(self, entry, "text/css", self.MAX_AGE)
+
+    def missing(self):
+        # Empty and uncached, so a stylesheet added later is picked up on the next request
         self.client.header << website.Header("Content-Type", "text/css")
-        self.client.header << website.Header("Cache-Control", "public, max-age=604800, immutable")
-        await self.load_style("/".join(self.request[1:]))
-
-    async def load_style(self, filename: str):
-        data = await website.buffer.File(website.path+"resource/style/"+filename).compile()
-        if data.startswith(b"# meta"):
-            lines = data.splitlines(False)[1:]
-            for index, fname in enumerate(lines, start=1):
-                if fname:
-                    if fname.startswith(b"# meta"):
-                        self.client.buffer << b"\n".join(lines[index+1:])
-                        break
-                    await self.load_style(fname.decode())
-        else:
-            self.client.buffer << data
+        self.client.header << website.Header("Cache-Control", "no-store")
+        self.client.buffer << b""
+
+    def load_style(self, filename: str, files: list[str]) -> list[bytes]:
+        # Flattens the "# meta" imports once, the result is cached until a file changes
+        if not filename or ".." in filename.split("/"):
+            raise ValueError(f"Invalid Style: {filename}")
+        path = website.path+"resource/style/"+filename
+        files.append(path)
+        with open(path, "rb") as file:
+            data = file.read()
+        if not data.startswith(b"# meta"):
+            return [data]
+        parts = []
+        lines = data.splitlines(False)[1:]
+        for index, fname in enumerate(lines, start=1):
+            if fname:
+                if fname.startswith(b"# meta"):
+                    parts.append(b"\n".join(lines[index+1:]))
+                    break
+                parts.extend(self.load_style(fname.decode(), files))
+        return parts
+
+async def page(request: website.Request, filename: str):
+    # Static pages are compiled once per change of the template file
+    path = f"{website.path}web/page/{filename}"
+    if (entry := webcache.cache.get(path)) is None:
+        entry = webcache.cache.put(path, await website.buffer.Python(path, request).compile(), [path])
+    webcache.respond(request, entry, "text/html")
+
+def WebPage(filename: str) -> type:
+    class Page(website.Request):
+        async def handle(self):
+            await page(self, filename)
+    return Page
 
 class WebRegister(website.Request):
     async def handle(self):
         if not (uname := self.client.query.get("name", None)):
-            return self.client.buffer << website.buffer.Python(f"{website.path}web/page/register.html", self)
+            return await page(self, "register.html")
 
         if (await db.Database().user_exists(uname)):
             self._fail = "Username Already Registered"
@@ -93,27 +232,76 @@ class WebRegister(website.Request):
         return self.client.buffer << website.buffer.Python(f"{website.path}web/page/home.html", self)
 
 class WebScoreBoard(website.Request):
+
+    PAGE = 50
+
+    async def handle(self):
+        try:
+            self.page = max(int(self.client.query.get("page", 0)), 0)
+        except ValueError:
+            self.page = 0
+        self._count = 0
+        # Rows are appended between the page head and foot as they are read, never joined into one string
+        self.client.buffer << website.buffer.Python(f"{website.path}web/page/scoreboard.html", self)
+        await self.fill()
+        self.client.buffer << website.buffer.Python(f"{website.path}web/page/scoreboard_end.html", self)
+
+    def _rows(self, rows) -> bytes:
+        self._count += len(rows)
+        return "".join(f"<tr><td>{uname}</td><td>{game}</td><td>{ai}</td><td>{score}</td></tr>" for uname, game, ai, score in rows).encode()
+
+    async def fill(self):
+        if (rows := db.Database().leaderboard.page(page=self.page, size=self.PAGE)) is not None:
+            self.client.buffer << self._rows(rows)
+            return
+        # Beyond the cached top scores
+        async for res in db.Database().score_list(page=self.page, size=self.PAGE):
+            self.client.buffer << self._rows(res)
+
+    async def nav(self) -> str:
+        links = []
+        if self.page:
+            links.append(f'<a href="/scoreboard?page={self.page - 1}">Previous</a>')
+        if self._count >= self.PAGE:
+            links.append(f'<a href="/scoreboard?page={self.page + 1}">Next</a>')
+        return " ".join(links)
+
+class WebMetrics(website.Request):
     async def handle(self):
-        return self.client.buffer << website.buffer.Python(f"{website.path}web/page/scoreboard.html", self)
+        self.client.header << website.Header("Content-Type", "text/plain; version=0.0.4")
+        self.client.header << website.Header("Cache-Control", "no-store")
+        self.client.buffer << metrics.registry.text().encode()
 
-    async def fill(self) -> str:
-        data = ""
-        async for res in db.Database().score_list():
-            for uname, game, ai, score in res:
-                data += f"<tr><td>{uname}</td><td>{game}</td><td>{ai}</td><td>{score}</td></tr>"
-        return data
+def raise_file_limit(count: int):
+    # Every idle connection holds a descriptor, the default soft limit is often 1024
+    try:
+        import resource
+    except ImportError:
+        return # Windows
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < count:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (count if hard == resource.RLIM_INFINITY else min(count, hard), hard))
 
 class Server(node.Server):
     # Get Database Referance
     database = db.Database()
+    blobs = blob.Store(catalogue.catalogue)
 
     class WebRequest(website.Request):
         inst = None
         end = asyncio.Event()
 
         async def handle(self):
-            print(f"{self.client.peer}:{self.client.port} /{'/'.join(self.request)}")
-            await self.tree.traverse(self)
+            log.debug("%s:%s /%s", self.client.peer, self.client.port, "/".join(self.request))
+            # Unknown paths share one name so they cannot grow the metrics without bound
+            route = self.request[0] if self.request and self.request[0] in self.ROUTES else ""
+            start = time.perf_counter()
+            error = True
+            try:
+                await self.tree.traverse(self)
+                error = False
+            finally:
+                metrics.registry.record("web", f"/{route}", time.perf_counter() - start, error=error)
 
         def kill(self):
             if self.client.query.get("key") == "adminkill":
@@ -125,35 +313,106 @@ class Server(node.Server):
             self.client.buffer << website.buffer.Python(f"{website.path}web/page/kill.html", self)
 
         tree = website.Tree(
-            (home := website.buffer.Python(f"{website.path}web/page/home.html")),
+            (home := WebPage("home.html")),
             home, home,
             scoreboard=WebScoreBoard,
             register=WebRegister,
             kill=kill,
             style=CSStyle,
+            metrics=WebMetrics,
         )
+        ROUTES = ("scoreboard", "register", "kill", "style", "metrics")
 
-    def __init__(self):
+    def __init__(self, shared: bool=False):
         self.WebRequest.inst = self
         self.cfg = website.config("server.cfg")["server"]
         port = int(self.cfg["port"])
-        self.web = website.Server(self.WebRequest, port=port+1, ssl=port+2)
-        website.buffer.Buffer.cache_disable = True # DEBUG
-        super().__init__("", port, int(self.cfg["user_count"]), SClient, echo=node.dispatch.echo)
+        public = ports = (port, port+1, port+2)
+        self.relays: list[relay.Relay] = []
+        if shared:
+            # Workers serve on private loopback ports behind relays that share the public ones
+            ports = tuple(relay.free_ports(len(public)))
+            self.relays = [relay.Relay(outer, inner) for outer, inner in zip(public, ports)]
+        self.web = website.Server(self.WebRequest, port=ports[1], ssl=ports[2])
+        website.buffer.Buffer.cache_disable = self.cfg.get("debug", "false") == "true"
+        self.sessions = auth.Sessions(auth.key(PATH+"session.key"))
+        # user_count is the soft limit of admitted clients, max_connections the hard limit of open sockets
+        self.admission = asyncio.Semaphore(int(self.cfg["user_count"]))
+        self.unbuffered = False # Set once no node stream was found for a connection
+        capacity = int(self.cfg.get("max_connections", "16384"))
+        # A relayed connection holds three descriptors in the worker, the public one and both loopback ends
+        raise_file_limit(capacity * (3 if shared else 1) + 256)
+        super().__init__("127.0.0.1" if shared else "", ports[0], capacity, SClient, echo=node.dispatch.echo)
 
     async def __aenter__(self):
         await self.database.__aenter__()
+        await self.database.indexes()
+        await self.database.load_leaderboard()
+        await self.precompute()
         await super().__aenter__()
         await self.web.__aenter__()
+        for proxy in self.relays:
+            await proxy.__aenter__()
         return self
+    async def precompute(self):
+        # Compress every game and AI before the first client asks
+        files = []
+        for gid, _ in await self.database.game_list():
+            _, folder = await self.database.game(gid)
+            files.append(loader.game_file(folder))
+            for aid, _ in await self.database.ai_list(gid):
+                files.append(loader.ai_file(folder, (await self.database.ai(aid))[1]))
+        for filename in files:
+            try:
+                await self.blobs.aget(filename)
+            except FileNotFoundError:
+                log.warning("Missing File: %s", filename)
+
     async def __aexit__(self, *args):
+        for proxy in self.relays:
+            await proxy.__aexit__(*args)
         await self.web.__aexit__(*args)
         await super().__aexit__(*args)
+        await self.database.flush()
         await self.database.__aexit__(*args)
         return
 
-async def main(repopulate=False):
-    print("Server")
+WORKER_STOP = 30 # Seconds a worker has to flush and exit once asked
+
+def work(index: int, requests: mp.Queue, replies: mp.Queue):
+    Interface.schedule(main(writer=broker.Writer(index, requests, replies)))
+    Interface.main()
+
+async def supervise(workers: int):
+    # Created before the workers start so every worker signs session tokens with the same key
+    auth.key(PATH+"session.key")
+    hub = broker.Broker(workers)
+    hub.start()
+    # Spawned rather than forked, the parent is running the event loop and possibly the Tk client
+    context = mp.get_context("spawn")
+    procs = [context.Process(target=work, args=(index, hub.requests, hub.replies[index])) for index in range(workers)]
+    for proc in procs:
+        proc.start()
+    log.info("Workers: %s", workers)
+
+    # The first worker to stop, for instance through /kill, asks the rest to stop
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, mp.connection.wait, [proc.sentinel for proc in procs])
+    hub.shutdown()
+    # Terminating a worker can tear a message on the shared queue, so it is only a last resort
+    for proc in procs:
+        await loop.run_in_executor(None, proc.join, WORKER_STOP)
+        if proc.is_alive():
+            log.warning("Worker Did Not Stop: %s", proc.pid)
+            proc.terminate()
+            await loop.run_in_executor(None, proc.join)
+    await loop.run_in_executor(None, hub.stop)
+
+async def main(repopulate=False, workers: int=1, writer: broker.Writer=None):
+    cfg = website.config("server.cfg", write=False)["server"]
+    logging.basicConfig(level=cfg.get("log_level", "info").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    log.addFilter(metrics.Sampler(int(cfg.get("log_sample", "1"))))
+    log.info("Server")
     # Repopulate the Database
     if repopulate:
         Server.database.new()
@@ -161,12 +420,27 @@ async def main(repopulate=False):
             await Server.database.repopulate()
             games = website.config("game.cfg", write=False)["games"]
             for k,v in games.items():
-                await Server.database._add_games_ai((k,v), *website.config(f"../../games/g_{v}/ai.cfg", write=False)["ai"].items())
+                if (entry := catalogue.catalogue.game(v)) is None:
+                    log.warning("Missing Game: %s", v)
+                    continue
+                await Server.database._add_games_ai((k,v), *entry.ais.items())
+
+    if workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        log.warning("SO_REUSEPORT Unavailable: Running One Worker")
+        workers = 1
+    if workers > 1:
+        await supervise(workers)
+        return Interface.stop()
 
-    server = Server()
+    server = Server(shared=writer is not None)
+    if writer is not None:
+        Server.database.writer = writer
+        writer.start(Server.database, server.WebRequest.end.set)
     #  Main Serving Loop
     async with server:
         await server.WebRequest.end.wait()
+    if writer is not None:
+        writer.close()
 
     Interface.stop()
 
@@ -1,50 +1,118 @@
 import game
 from games.g_dino.main import main
 
-if __name__ == "__main__":
+def parser():
+    import argparse
+    parser_main = argparse.ArgumentParser(description="Dinosaur AI Trainer")
+    parser_main.add_argument("-n", "--population", dest="population", type=int, default=12,
+        help="Population Size")
+    parser_main.add_argument("--resume", dest="resume", action="store_true",
+        help="Continue from the last Checkpoint")
+    parser_main.add_argument("--seed", dest="seed", type=int,
+        help="Seed for the Episodes every Genome is Scored on")
+    parser_main.add_argument("--reseed", dest="reseed", type=int, default=1,
+        help="Generations between new Episode Seeds, 0 Keeps one Course")
+    parser_main.add_argument("--batch", dest="batch", action="store_true",
+        help="Simulate the whole Population in one Process")
+    parser_main.add_argument("--cluster", dest="cluster", type=int,
+        help="Coordinate Remote Workers on this Port")
+    parser_main.add_argument("--local", dest="local", type=int, default=0,
+        help="Local Workers to Spawn for the Cluster")
+    return parser_main
+
+def train(args):
+    import os
     import json
     import time
+    import base64
+    import random
     import neural
-    import pickle
+    import weights
+    import checkpoint
+    import multiprocessing as mp
     from path import PATH
 
     GAME_PATH = f"{PATH}games/g_dino/net/"
+    SCORE_CAP = 300 * 20 # Per Iteration
+    ITERATIONS = 1 # Seeded episodes are shared by the whole population
 
     # AI Train
-    LOG_FILE = f"{GAME_PATH}data.log"
-    with open(LOG_FILE, "r") as file:
-        log_data: list[float] = json.load(file)
+    LOG_FILE = f"{GAME_PATH}train.log"
+    OLD_LOG_FILE = f"{GAME_PATH}data.log"
     FILE = f"{GAME_PATH}ai.net"
-    try:
-        with open(FILE, "rb") as file:
-            network = pickle.load(file)
-    except (IOError, EOFError):
-        open(FILE, "wb").close()
-        network = main.AI
+    if os.path.exists(LOG_FILE) and not args.resume:
+        return print("Training Log Exists: Use --resume")
+    if os.path.exists(FILE) and not args.resume:
+        return print("Network Exists: Use --resume")
+    log = checkpoint.Log(LOG_FILE)
+    if not len(log) and os.path.exists(OLD_LOG_FILE):
+        # Scores from the old JSON list log carry over as the first generations
+        with open(OLD_LOG_FILE, "r") as file:
+            for score in json.load(file):
+                log.append({"generation": len(log), "score": score, "imported": "data.log"})
+        print("Imported:", len(log), "Generations from data.log")
+    network = main.AI
+    seed = random.randrange(2**32) if args.seed is None else args.seed
+    if args.resume:
+        if log.last and args.seed is None:
+            seed = log.last.get("seed", seed)
+        try:
+            network = weights.load(FILE)
+        except ValueError as e:
+            raise SystemExit(f"{FILE}: {e}, a pickled network can be upgraded with: python weights.py {FILE}")
+        except IOError:
+            if log.last and "best" in log.last:
+                network = weights.loads(base64.b64decode(log.last["best"]))
 
     start_time = time.time()
-    prev_time = start_time
-    algo = neural.algorithm.Genetic(network, 12, 0.8, 0.2)
+    algo = neural.algorithm.Genetic(network, args.population, 0.8, 0.2)
+    workers = []
+    if args.batch:
+        from games.g_dino import batch
+        trainer = batch.Trainer(ITERATIONS)
+    elif args.cluster:
+        import cluster
+        import website
+        password = website.config("server.cfg", write=False)["server"]["password"]
+        trainer = cluster.Cluster(args.cluster, password, main.__module__, ITERATIONS, SCORE_CAP)
+        workers = cluster.spawn(args.local, args.cluster, password)
+    else:
+        trainer = game.Trainer(main.__module__, min(algo.population_size, mp.cpu_count()), ITERATIONS, SCORE_CAP)
+    trainer.open()
     try:
         while True:
+            print("Generation:", len(log))
+            trainer.seed = seed + (len(log) // args.reseed if args.reseed else 0)
+            prev_time = time.time()
+            score = trainer.run(algo, timeout=150)
             current_time = time.time()
+            print("Score:", round(score))
+            if trainer.stragglers:
+                print("Timeout:", trainer.stragglers)
             print(round(current_time - prev_time), round(current_time - start_time))
-            prev_time = current_time
-            print("Generation:", len(log_data))
-            score = game.run_train(
-                main,
-                algo,
-                3, timeout=150,
-            )
-            if score is not None:
-                log_data.append(score)
-                print("Score:", round(score))
-            else:
-                print("Timeout")
-            with open(FILE, "wb") as file:
-                pickle.dump(algo.network, file)
-            with open(LOG_FILE, "w") as file:
-                json.dump(log_data, file)
+
+            data = weights.dumps(algo.network)
+            checkpoint.write(FILE, data)
+            log.append({
+                "generation": len(log),
+                "score": score,
+                "min": min(trainer.scores),
+                "max": max(trainer.scores),
+                "mean": sum(trainer.scores) / len(trainer.scores),
+                "stragglers": trainer.stragglers,
+                "seed": seed,
+                "episode_seed": trainer.seed,
+                "time": current_time - prev_time,
+                "best": base64.b64encode(data).decode(),
+            })
     finally:
-        with open(LOG_FILE, "w") as file:
-            json.dump(log_data, file)
+        trainer.close()
+        for proc in workers:
+            proc.terminate()
+        log.close()
+
+if __name__ == "__main__":
+    from interface import Interface
+    with Interface.main_thread():
+        train(parser().parse_args())
+    Interface.stop()
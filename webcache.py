@@ -0,0 +1,48 @@
+import os
+import website
+from collections import namedtuple
+
+__all__ = ["Entry", "Cache", "cache", "respond"]
+
+Entry = namedtuple("Entry", ("data", "files"))
+
+def mtime(filename: str) -> float:
+    try:
+        return os.stat(filename).st_mtime
+    except OSError:
+        return None
+
+class Cache:
+    # Compiled responses, valid for as long as none of their source files change
+
+    def __init__(self):
+        self._data: dict[str, Entry] = {}
+
+    def get(self, key: str) -> Entry:
+        if (entry := self._data.get(key)) is None:
+            return None
+        if any(mtime(filename) != modified for filename, modified in entry.files.items()):
+            del self._data[key]
+            return None
+        return entry
+
+    def put(self, key: str, data: bytes, files: list[str]) -> Entry:
+        entry = Entry(data, {filename: mtime(filename) for filename in files})
+        self._data[key] = entry
+        return entry
+
+    def invalidate(self, key: str=None):
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+
+cache = Cache()
+
+def respond(request: website.Request, entry: Entry, content_type: str, max_age: int=0):
+    # No revalidation headers, a conditional request could not be answered with 304 anyway
+    client = request.client
+    client.header << website.Header("Content-Type", content_type)
+    if max_age:
+        client.header << website.Header("Cache-Control", f"public, max-age={max_age}")
+    client.buffer << entry.data
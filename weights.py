@@ -0,0 +1,217 @@
+import copy
+import mmap
+import pickle
+import struct
+import neural
+import hashlib
+import checkpoint
+import numpy as np
+from collections import namedtuple
+
+__all__ = ["Node", "Shape", "shape", "flatten", "build", "dumps", "loads", "load", "view", "digest", "convert", "Batch", "parity"]
+
+Node = namedtuple("Node", ("id", "kind", "sources"))
+Shape = namedtuple("Shape", ("inputs", "outputs", "nodes"))
+
+def state(obj):
+    # Networks, layouts and neurons all define their own pickle state
+    return obj.__reduce_ex__(4)[2]
+
+def shape(network) -> Shape:
+    inputs, outputs, nodes = state(state(network)[0])
+    return Shape(tuple(inputs), tuple(outputs), tuple(Node(i, cls.__name__, tuple(src)) for i, src, cls in nodes))
+
+def flatten(network) -> tuple[Shape, np.ndarray]:
+    # Per neuron: bias, weights in source order, then (memory, weight) for recurrent neurons
+    layout = shape(network)
+    params = []
+    for node, neuron in zip(layout.nodes, state(network)[1]):
+        _, bias, weights, *recurrent = state(neuron)
+        params.append(bias)
+        params.extend(weights.get(s, 0.0) for s in node.sources)
+        if recurrent:
+            params.extend(recurrent[0])
+    return layout, np.array(params, dtype=np.float64)
+
+def build(layout: Shape, params: np.ndarray) -> neural.Network:
+    # Only whitelisted neural classes are ever constructed
+    def make(cls: type, state: tuple):
+        obj = cls.__new__(cls)
+        obj.__setstate__(state)
+        return obj
+
+    classes = {node.kind: getattr(neural.neuron, node.kind) for node in layout.nodes}
+    neurons, position = [], 0
+    for node in layout.nodes:
+        count = len(node.sources)
+        state = [node.id, float(params[position]), dict(zip(node.sources, map(float, params[position + 1:position + 1 + count])))]
+        position += 1 + count
+        if node.kind == "Recurrent":
+            state.append(tuple(map(float, params[position:position + 2])))
+            position += 2
+        neurons.append(make(classes[node.kind], tuple(state)))
+    nodes = [[node.id, list(node.sources), classes[node.kind]] for node in layout.nodes]
+    return make(neural.Network, (make(neural.layout.Layout, (layout.inputs, layout.outputs, nodes)), neurons))
+
+# Binary network file
+# Header, input ids, output ids, node ids, kinds, source counts, sources, padding, float64 parameters
+
+MAGIC = b"NNET"
+VERSION = 1
+KINDS = ("Input", "Neuron", "Hidden", "Recurrent", "Output")
+_HEADER = struct.Struct("<4sHHIIIII")
+
+def dumps(network: neural.Network) -> bytes:
+    layout, params = flatten(network)
+    sources = [s for node in layout.nodes for s in node.sources]
+    table = b"".join((
+        np.array(layout.inputs, dtype="<u4").tobytes(),
+        np.array(layout.outputs, dtype="<u4").tobytes(),
+        np.array([node.id for node in layout.nodes], dtype="<u4").tobytes(),
+        np.array([KINDS.index(node.kind) for node in layout.nodes], dtype="u1").tobytes(),
+        np.array([len(node.sources) for node in layout.nodes], dtype="<u2").tobytes(),
+        np.array(sources, dtype="<u4").tobytes(),
+    ))
+    table += bytes(-(_HEADER.size + len(table)) % 8)
+    header = _HEADER.pack(MAGIC, VERSION, 0, len(layout.inputs), len(layout.outputs), len(layout.nodes), len(sources), len(params))
+    return header + table + params.astype("<f8").tobytes()
+
+def view(data) -> tuple[Shape, np.ndarray]:
+    # The parameters are a view onto data, so a mapped file is never copied
+    if len(data) < _HEADER.size:
+        raise ValueError("Network File Truncated")
+    magic, version, _, inputs, outputs, count, sources, params = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Unknown Network Format")
+
+    offset = _HEADER.size
+    def array(dtype: str, size: int) -> np.ndarray:
+        nonlocal offset
+        arr = np.frombuffer(data, dtype=dtype, count=size, offset=offset)
+        offset += arr.nbytes
+        return arr
+
+    ids_in, ids_out, ids = array("<u4", inputs), array("<u4", outputs), array("<u4", count)
+    kinds, counts, srcs = array("u1", count), array("<u2", count), array("<u4", sources)
+    if int(counts.sum()) != sources or int(kinds.max(initial=0)) >= len(KINDS):
+        raise ValueError("Corrupt Network Layout")
+    offset += -offset % 8
+    weights = array("<f8", params)
+
+    nodes, position = [], 0
+    for nid, kind, size in zip(ids.tolist(), kinds.tolist(), counts.tolist()):
+        nodes.append(Node(nid, KINDS[kind], tuple(srcs[position:position + size].tolist())))
+        position += size
+    layout = Shape(tuple(ids_in.tolist()), tuple(ids_out.tolist()), tuple(nodes))
+    if sum(1 + len(n.sources) + 2 * (n.kind == "Recurrent") for n in layout.nodes) != params:
+        raise ValueError("Corrupt Network Parameters")
+    return layout, weights
+
+def loads(data) -> neural.Network:
+    return build(*view(data))
+
+def load(filename: str) -> neural.Network:
+    with open(filename, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            try:
+                layout, params = view(buffer)
+            except ValueError as e:
+                # The traceback holds views onto the map, it has to be gone before the map can close
+                error = str(e)
+            else:
+                network = build(layout, params)
+                del params
+                return network
+    raise ValueError(f"{error}: {filename}")
+
+def convert(filename: str, output: str=None) -> neural.Network:
+    # One off upgrade of a pickled network, only run it on files you trust
+    with open(filename, "rb") as file:
+        network = pickle.load(file)
+    if not isinstance(network, neural.Network):
+        raise ValueError(f"Not a Pickled Network: {filename}")
+    checkpoint.write(output or filename, dumps(network))
+    return network
+
+def digest(network: neural.Network, *salt) -> bytes:
+    # Content hash of the layout and every weight
+    return hashlib.blake2b(dumps(network) + repr(salt).encode(), digest_size=16).digest()
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-x))
+
+class _Layer:
+    def __init__(self, cols: list[int], weights: np.ndarray, bias: np.ndarray, recurrent: np.ndarray, memory: np.ndarray):
+        self.cols, self.weights, self.bias = cols, weights, bias
+        self.recurrent, self.memory = recurrent, memory
+
+class Batch:
+    # Feed a whole population of identically shaped networks as matrix operations
+
+    def __init__(self, networks: list):
+        flat = [flatten(n) for n in networks]
+        self.shape = flat[0][0]
+        if any(s != self.shape for s, _ in flat):
+            raise ValueError("Networks do not share a layout")
+        params = np.stack([p for _, p in flat])
+        self.size = len(networks)
+
+        index = {node.id: i for i, node in enumerate(self.shape.nodes)}
+        offset, depth, layers = [], {}, {}
+        position = 0
+        for node in self.shape.nodes:
+            offset.append(position)
+            position += 1 + len(node.sources) + 2 * (node.kind == "Recurrent")
+            depth[node.id] = 1 + max(depth[s] for s in node.sources) if node.sources else 0
+            layers.setdefault(depth[node.id], []).append(index[node.id])
+
+        self.inputs = [index[i] for i in self.shape.inputs]
+        self.outputs = [index[i] for i in self.shape.outputs]
+        self._input_bias = params[:, [offset[i] for i in self.inputs]]
+        self.layers: list[_Layer] = []
+        for d in sorted(layers)[1:]:
+            cols = layers[d]
+            weights = np.zeros((self.size, len(self.shape.nodes), len(cols)))
+            recurrent = np.zeros((self.size, len(cols)))
+            memory = np.zeros((self.size, len(cols)))
+            for j, col in enumerate(cols):
+                node = self.shape.nodes[col]
+                for k, src in enumerate(node.sources, start=1):
+                    weights[:, index[src], j] = params[:, offset[col] + k]
+                if node.kind == "Recurrent":
+                    memory[:, j] = params[:, offset[col] + len(node.sources) + 1]
+                    recurrent[:, j] = params[:, offset[col] + len(node.sources) + 2]
+            self.layers.append(_Layer(cols, weights, params[:, [offset[c] for c in cols]], recurrent, memory))
+
+    def feed(self, *values: float) -> np.ndarray:
+        act = np.zeros((self.size, len(self.shape.nodes)))
+        data = np.zeros(len(self.inputs))
+        data[:len(values)] = values
+        act[:, self.inputs] = sigmoid(data + self._input_bias)
+        for layer in self.layers:
+            out = sigmoid(np.einsum("pn,pnl->pl", act, layer.weights) + layer.bias + layer.recurrent * layer.memory)
+            act[:, layer.cols] = out
+            layer.memory = out
+        return act[:, self.outputs]
+
+def parity(network: neural.Network, inputs: int=None, samples: int=32, seed: int=0) -> float:
+    # Largest difference between Batch.feed and the network's own feed over a run of random inputs
+    # Only the first inputs values are given, as the caller feeds them, Batch pads the rest with zeros
+    reference = copy.deepcopy(network)
+    batch = Batch([network])
+    error = 0.0
+    for values in np.random.default_rng(seed).random((samples, len(batch.inputs) if inputs is None else inputs)).tolist():
+        out = np.asarray(reference.feed(*values), dtype=np.float64)
+        error = max(error, float(np.abs(out - batch.feed(*values)[0]).max()))
+    return error
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert Pickled Networks to the Binary Format")
+    parser.add_argument("files", nargs="+",
+        help="Pickled Network Files, Converted in Place")
+    args = parser.parse_args()
+    for filename in args.files:
+        convert(filename)
+        print("Converted:", filename)